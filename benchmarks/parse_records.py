@@ -0,0 +1,106 @@
+"""
+Compares the per-line cost of the pydantic models in pg_lupa's public API
+with the lightweight records used inside the parsing pipeline.
+
+    $ poetry run python -m benchmarks.parse_records [number of lines]
+"""
+
+import datetime
+import io
+import sys
+import time
+import tracemalloc
+
+from pg_lupa import lupa
+
+TIMESTAMP = datetime.datetime(2022, 5, 22, 10, 50, 43, tzinfo=datetime.timezone.utc)
+SESSIONS = 500
+
+
+def session_fields(i: int) -> dict:
+    # Slicing yields a fresh string per line, like a regex match group does
+    user_at_db = "foo@foo"
+    return dict(
+        pid=1000 + i % SESSIONS, username=user_at_db[:3], database=user_at_db[4:]
+    )
+
+
+def make_log(n: int) -> str:
+    return "".join(
+        f"2022-05-22 10:50:{i % 60:02d} CEST [{1000 + i % 500}-{i}] foo@foo "
+        f"LOG:  duration: 1.{i % 1000:03d} ms  statement: SELECT {i}\n"
+        for i in range(n)
+    )
+
+
+def make_pydantic(i: int):
+    context = lupa.LogPrefixInfo(
+        timestamp=TIMESTAMP, log_line_no=i, **session_fields(i)
+    )
+    return (
+        lupa.LogLine(line="x"),
+        lupa.Statement(
+            start_time=TIMESTAMP,
+            end_time=TIMESTAMP,
+            context=context,
+            pid=context.pid,
+            log_line_no=i,
+            statement="SELECT 1",
+            duration=0.001,
+        ),
+    )
+
+
+def make_records(i: int):
+    context = lupa._make_prefix_record(
+        timestamp=TIMESTAMP, log_line_no=i, **session_fields(i)
+    )
+    return (
+        lupa._LineRecord(None, "x"),
+        lupa._StatementRecord(
+            start_time=TIMESTAMP,
+            end_time=TIMESTAMP,
+            context=context,
+            pid=context.pid,
+            log_line_no=i,
+            statement="SELECT 1",
+            duration=0.001,
+        ),
+    )
+
+
+def measure(label: str, make, n: int) -> None:
+    t0 = time.perf_counter()
+    for i in range(n):
+        make(i)
+    elapsed = time.perf_counter() - t0
+
+    tracemalloc.start()
+    kept = [make(i) for i in range(n)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{label:>10}: {elapsed / n * 1e6:6.2f} us/line, "
+        f"{size / n:6.0f} bytes/line retained ({len(kept)} lines)"
+    )
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    measure("pydantic", make_pydantic, n)
+    measure("records", make_records, n)
+
+    data = make_log(n)
+    t0 = time.perf_counter()
+    model = lupa.parse_log_data_automagically(io.StringIO(data))
+    elapsed = time.perf_counter() - t0
+    print(
+        f"{'parse':>10}: {elapsed / n * 1e6:6.2f} us/line end to end "
+        f"({len(model.statements)} statements)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Measures how long the pg_lupa command line takes to start up, to show help and
+to render a report for a tiny log, each in a fresh interpreter.
+
+    $ poetry run python -m benchmarks.startup [number of runs]
+"""
+
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TINY_LOG = (
+    "2022-05-22 10:50:43 CEST [1000-1] foo@foo LOG:  duration: 1.000 ms  "
+    "statement: SELECT 1\n"
+)
+
+
+def measure(label: str, args: list[str], runs: int) -> None:
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, capture_output=True)
+        timings.append(time.perf_counter() - t0)
+
+    print(
+        f"{label:>8}: {statistics.median(timings) * 1e3:6.1f} ms median, "
+        f"{min(timings) * 1e3:6.1f} ms best ({runs} runs)"
+    )
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    measure("python", ["-c", "pass"], runs)
+    measure("import", ["-c", "import pg_lupa.lupa"], runs)
+    measure("help", ["-m", "pg_lupa", "--help"], runs)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".log") as log:
+        log.write(TINY_LOG)
+        log.flush()
+        measure(
+            "report",
+            ["-m", "pg_lupa", "--input-logs", log.name, "--output-html", "-"],
+            runs,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,23 @@ from . import lupa
     type=click.Choice(list(lupa.ProcessSortOrder.__members__), case_sensitive=False),
     help="Sort order for processes in report",
 )
+@click.option(
+    "--renderer",
+    default="svg",
+    type=click.Choice([r.value for r in lupa.Renderer], case_sensitive=False),
+    help="How the report draws the timeline (canvas scales to larger logs)",
+)
+@click.option(
+    "--payload-format",
+    default="compact",
+    type=click.Choice([f.value for f in lupa.PayloadFormat], case_sensitive=False),
+    help="How report data is embedded in the HTML (compact or full JSON)",
+)
+@click.option(
+    "--compress-payload/--no-compress-payload",
+    default=False,
+    help="Compress the report data (needs a recent browser to view)",
+)
 @click.option(
     "--log-line-prefix-format",
     default=None,
@@ -35,21 +52,50 @@ from . import lupa
     type=str,
     help="Regex with capturing groups to match log line prefixes",
 )
+@click.option(
+    "--infer-log-line-prefix/--no-infer-log-line-prefix",
+    default=True,
+    help="Guess log_line_prefix from the input if no format or regex is given",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of processes to use for parsing logs",
+)
+@click.option(
+    "--cache-dir",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="Directory in which to keep parsed logs, to skip parsing them again",
+)
 def main(
     input_logs,
     output_html,
     sort_processes_by,
+    renderer,
+    payload_format,
+    compress_payload,
     log_line_prefix_format,
     log_line_prefix_regex,
     timezone,
+    infer_log_line_prefix,
+    jobs,
+    cache_dir,
 ):
     viz_options = lupa.VizOptions(
         process_sort_order=lupa.ProcessSortOrder(sort_processes_by.lower()),
         timezone=timezone,
+        renderer=lupa.Renderer(renderer.lower()),
+        payload_format=lupa.PayloadFormat(payload_format.lower()),
+        compress_payload=compress_payload,
     )
     parse_options = lupa.ParseOptions(
         log_line_prefix_format=log_line_prefix_format,
         log_line_prefix_regex=log_line_prefix_regex,
+        infer_log_line_prefix=infer_log_line_prefix,
+        jobs=jobs,
     )
 
     lupa.run_analyzer(
@@ -57,6 +103,7 @@ def main(
         output_file=output_html or sys.stdout,
         parse_options=parse_options,
         viz_options=viz_options,
+        cache_dir=cache_dir,
     )
 
 
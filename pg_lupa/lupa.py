@@ -1,20 +1,39 @@
+import array
+import base64
+import bisect
 import collections
 import colorsys
+import contextlib
 import datetime
 import enum
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import mmap
+import os
+import queue
 import random
 import re
+import stat
 import string
+import sys
+import threading
 import typing
-from typing import Callable, Iterator, Optional
+from typing import Callable, Iterable, Iterator, Optional
 
-import dateutil.parser
 import dateutil.tz
-import jinja2
-import pkg_resources
 import pydantic
 
+# jinja2, dateutil.parser, concurrent.futures and importlib.resources take a
+# while to import, and aren't needed by every run, so they are imported where
+# they're used.
+if typing.TYPE_CHECKING:
+    import jinja2
+
 __version__ = "0.0.3"
 
 
@@ -70,16 +89,121 @@ def sufficient_contrast_with_white(rgb) -> bool:
     return contrast_ratio_with_white(rgb) > 1.5
 
 
+# Offsets for time zone abbreviations that dateutil doesn't know about itself.
+TIMEZONE_ABBREVIATION_OFFSETS = {
+    "CEST": 2 * 3600,
+    "CET": 1 * 3600,
+}
+
+UTC_TIMEZONE_NAMES = {"UTC", "GMT", "Z", "z"}
+
+
+@functools.lru_cache(maxsize=None)
+def _tzinfo_for_name(name: str) -> Optional[datetime.tzinfo]:
+    if name in UTC_TIMEZONE_NAMES:
+        return dateutil.tz.UTC
+
+    try:
+        offset = TIMEZONE_ABBREVIATION_OFFSETS[name]
+    except KeyError:
+        return None
+
+    return dateutil.tz.tzoffset(None, offset)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_timestamp_second(
+    date_and_time: str, tz_name: str
+) -> Optional[datetime.datetime]:
+    tz = _tzinfo_for_name(tz_name)
+    if tz is None:
+        return None
+
+    digits = date_and_time[0:4] + "".join(
+        date_and_time[i : i + 2] for i in (5, 8, 11, 14, 17)
+    )
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+
+    try:
+        return datetime.datetime(
+            int(digits[0:4]),
+            int(digits[4:6]),
+            int(digits[6:8]),
+            int(digits[8:10]),
+            int(digits[10:12]),
+            int(digits[12:14]),
+            tzinfo=tz,
+        )
+    except ValueError:
+        return None
+
+
+def _parse_timestamp_fast(s: str) -> Optional[datetime.datetime]:
+    # Handles the shapes produced by %t and %m in log_line_prefix
+    # ("2022-05-22 10:50:29.123 CEST"), as well as the ISO timestamps in
+    # Google Cloud Logging exports ("2022-05-22T08:50:29.123456Z").
+    if (
+        len(s) < 20
+        or s[4] != "-"
+        or s[7] != "-"
+        or s[10] not in " T"
+        or s[13] != ":"
+        or s[16] != ":"
+    ):
+        return None
+
+    rest = s[19:]
+    microsecond = 0
+
+    if rest.startswith("."):
+        end = 1
+        while end < len(rest) and rest[end].isdigit():
+            end += 1
+        fraction = rest[1:end]
+        if not fraction.isascii():
+            return None
+        microsecond = int(fraction.ljust(6, "0")[:6])
+        rest = rest[end:]
+
+    if rest.startswith(" "):
+        tz_name = rest[1:]
+    elif rest in UTC_TIMEZONE_NAMES:
+        tz_name = rest
+    else:
+        return None
+
+    base = _parse_timestamp_second(s[:19], tz_name)
+    if base is None:
+        return None
+
+    if microsecond:
+        return base.replace(microsecond=microsecond)
+
+    return base
+
+
 def parse_timestamp(s: str) -> datetime.datetime:
-    if s.endswith(" CEST"):
-        s = s.replace(" CEST", "+02:00")
+    rv = _parse_timestamp_fast(s)
+    if rv is not None:
+        return rv
+
+    for name, offset in TIMEZONE_ABBREVIATION_OFFSETS.items():
+        if s.endswith(" " + name):
+            s = s[: -len(name) - 1] + format_utc_offset(offset)
+            break
 
-    if s.endswith(" CET"):
-        s = s.replace(" CET", "+01:00")
+    import dateutil.parser
 
     return dateutil.parser.parse(s)
 
 
+def format_utc_offset(seconds: int) -> str:
+    sign = "-" if seconds < 0 else "+"
+    hours, minutes = divmod(abs(seconds) // 60, 60)
+    return f"{sign}{hours:02d}:{minutes:02d}"
+
+
 DURATION_LINE_RE = re.compile(r"^([0-9]+[.][0-9]{3}) ms +statement:(.*)$")
 DURATION_LINE_WITHOUT_STATEMENT_RE = re.compile(r"^([0-9]+[.][0-9]{3}) ms$")
 
@@ -98,6 +222,99 @@ class LogPrefixInfo(pydantic.BaseModel):
     application_name: Optional[str] = None
 
 
+# Lightweight counterparts of the models above, used inside the parsing pipeline
+# where one is created per log line. They are only converted into the pydantic
+# models when handed out through the public API.
+
+
+class _LineRecord(typing.NamedTuple):
+    timestamp: Optional[datetime.datetime]
+    line: str
+    # The line of the input the entry starts on, if known
+    line_no: Optional[int] = None
+
+
+class _SessionRecord(typing.NamedTuple):
+    pid: int
+    username: Optional[str] = None
+    database: Optional[str] = None
+    application_name: Optional[str] = None
+
+
+# The session part of a log line prefix repeats on every line a backend writes,
+# so records share one interned session instead of carrying their own copies.
+SESSION_CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=SESSION_CACHE_SIZE)
+def _intern_session(
+    pid: int,
+    username: Optional[str] = None,
+    database: Optional[str] = None,
+    application_name: Optional[str] = None,
+) -> _SessionRecord:
+    return _SessionRecord(
+        pid,
+        None if username is None else sys.intern(username),
+        None if database is None else sys.intern(database),
+        None if application_name is None else sys.intern(application_name),
+    )
+
+
+class _PrefixRecord(typing.NamedTuple):
+    timestamp: datetime.datetime
+    session: _SessionRecord
+    log_line_no: Optional[int] = None
+
+    @property
+    def pid(self) -> int:
+        return self.session.pid
+
+    @property
+    def username(self) -> Optional[str]:
+        return self.session.username
+
+    @property
+    def database(self) -> Optional[str]:
+        return self.session.database
+
+    @property
+    def application_name(self) -> Optional[str]:
+        return self.session.application_name
+
+
+def _make_prefix_record(
+    timestamp: datetime.datetime,
+    pid: int,
+    log_line_no: Optional[int] = None,
+    username: Optional[str] = None,
+    database: Optional[str] = None,
+    application_name: Optional[str] = None,
+) -> _PrefixRecord:
+    return _PrefixRecord(
+        timestamp,
+        _intern_session(pid, username, database, application_name),
+        log_line_no,
+    )
+
+
+# Anything with the attributes of LogLine can be fed to the parser.
+_AnyLogLine = typing.Union[LogLine, _LineRecord]
+
+
+def _prefix_info_from_record(record: _PrefixRecord) -> LogPrefixInfo:
+    # Records are built by the parser from already-converted values, so
+    # validating them again would only cost time.
+    return LogPrefixInfo.construct(
+        timestamp=record.timestamp,
+        pid=record.pid,
+        log_line_no=record.log_line_no,
+        username=record.username,
+        database=record.database,
+        application_name=record.application_name,
+    )
+
+
 class DataRow(pydantic.BaseModel):
     label: str
     value: str
@@ -148,6 +365,18 @@ def _make_prefix_regex(
     def add_application_name_pattern():
         re_comp.append(r"""(?P<application_name>.+)""")
 
+    def add_remote_host_pattern():
+        re_comp.append(r"""(?:[A-Za-z0-9_.:-]+|\[local\])""")
+
+    def add_remote_host_and_port_pattern():
+        re_comp.append(r"""(?:[A-Za-z0-9_.:-]+(?:\([0-9]+\))?|\[local\])""")
+
+    def add_session_id_pattern():
+        re_comp.append(r"""(?:[0-9a-f]+[.][0-9a-f]+)""")
+
+    def add_sqlstate_pattern():
+        re_comp.append(r"""(?:[0-9A-Z]{5})""")
+
     def add_optional_section():
         re_comp.append("(?:")
         closers.append(")?")
@@ -161,6 +390,10 @@ def _make_prefix_regex(
         "d": add_database_pattern,
         "l": add_log_line_pattern,
         "a": add_application_name_pattern,
+        "h": add_remote_host_pattern,
+        "r": add_remote_host_and_port_pattern,
+        "c": add_session_id_pattern,
+        "e": add_sqlstate_pattern,
         "q": add_optional_section,
         "%": lambda: add_literal_char("%"),
     }
@@ -203,96 +436,98 @@ def _make_prefix_regex(
     return "".join(re_comp)
 
 
-def _make_prefix_parser(
-    log_prefix_format: str,
-) -> Callable[[str], Optional[LogPrefixInfo]]:
-    return _make_prefix_parser_from_regex(_make_prefix_regex(log_prefix_format))
-
-
-def _make_prefix_parser_from_regex(
+def _make_prefix_record_parser_from_regex(
     regex: str,
-) -> Callable[[str], Optional[LogPrefixInfo]]:
+) -> Callable[[str], Optional[_PrefixRecord]]:
     compiled_regex = re.compile(regex)
 
-    active_handlers: dict[str, Callable[[str, LogPrefixInfo], None]] = {}
-
-    def handle_timestamp(value: str, info: LogPrefixInfo) -> None:
-        info.timestamp = parse_timestamp(value)
-
-    def handle_pid(value: str, info: LogPrefixInfo) -> None:
-        info.pid = int(value)
-
-    def handle_log_line_no(value: str, info: LogPrefixInfo) -> None:
-        info.log_line_no = int(value)
-
-    def handle_username(value: str, info: LogPrefixInfo) -> None:
-        info.username = value
-
-    def handle_database(value: str, info: LogPrefixInfo) -> None:
-        info.database = value
-
-    def handle_application_name(value: str, info: LogPrefixInfo) -> None:
-        info.application_name = value
-
-    handlers = {
-        "timestamp": handle_timestamp,
-        "pid": handle_pid,
-        "log_line_no": handle_log_line_no,
-        "username": handle_username,
-        "database": handle_database,
-        "application_name": handle_application_name,
+    converters: dict[str, Callable[[str], typing.Any]] = {
+        "timestamp": parse_timestamp,
+        "pid": int,
+        "log_line_no": int,
+        "username": str,
+        "database": str,
+        "application_name": str,
     }
 
+    active_converters: list[tuple[str, Callable[[str], typing.Any]]] = []
+
     for name in compiled_regex.groupindex:
         try:
-            handler = handlers[name]
+            converter = converters[name]
         except KeyError:
             raise ValueError(f"unknown field: {repr(name)}")
         else:
-            active_handlers[name] = handler
+            active_converters.append((name, converter))
 
-    default_pid = 0
-    default_datetime = datetime.datetime(1970, 1, 1)
-
-    def apply(s: str) -> Optional[LogPrefixInfo]:
+    def apply(s: str) -> Optional[_PrefixRecord]:
         m = compiled_regex.match(s)
         if not m:
             return None
 
-        return_value = LogPrefixInfo(
-            timestamp=default_datetime,
-            pid=default_pid,
-        )
+        fields = {}
 
-        for key, h in active_handlers.items():
+        for key, convert in active_converters:
             value = m.group(key)
             if value:
-                h(value, return_value)
+                fields[key] = convert(value)
 
-        if return_value.timestamp == default_datetime:
+        if "timestamp" not in fields:
             raise RuntimeError(
                 "log_line_prefix pattern not valid: didn't capture timestamp"
             )
 
-        if return_value.pid == default_pid:
+        if not fields.get("pid"):
             raise RuntimeError("log_line_prefix pattern not valid: didn't capture pid")
 
-        return return_value
+        return _make_prefix_record(**fields)
 
     return apply
 
 
-def make_prefix_parser(
+@functools.lru_cache(maxsize=None)
+def _make_prefix_record_parser(
     log_line_prefix: str,
-) -> Callable[[str], Optional[LogPrefixInfo]]:
+) -> Callable[[str], Optional[_PrefixRecord]]:
     try:
-        return _make_prefix_parser(log_line_prefix)
+        return _make_prefix_record_parser_from_regex(
+            _make_prefix_regex(log_line_prefix)
+        )
     except ValueError as e:
         raise ValueError(
             f"Invalid log_prefix_line format {repr(log_line_prefix)}: {e}"
         ) from e
 
 
+def _prefix_parser_from_record_parser(
+    parse_record: Callable[[str], Optional[_PrefixRecord]]
+) -> Callable[[str], Optional[LogPrefixInfo]]:
+    def apply(s: str) -> Optional[LogPrefixInfo]:
+        record = parse_record(s)
+        if record is None:
+            return None
+
+        return _prefix_info_from_record(record)
+
+    return apply
+
+
+def _make_prefix_parser_from_regex(
+    regex: str,
+) -> Callable[[str], Optional[LogPrefixInfo]]:
+    return _prefix_parser_from_record_parser(
+        _make_prefix_record_parser_from_regex(regex)
+    )
+
+
+def make_prefix_parser(
+    log_line_prefix: str,
+) -> Callable[[str], Optional[LogPrefixInfo]]:
+    return _prefix_parser_from_record_parser(
+        _make_prefix_record_parser(log_line_prefix)
+    )
+
+
 class DurationLogEntry(pydantic.BaseModel):
     duration_usec: int
     statement: Optional[str]
@@ -303,14 +538,20 @@ class HoldingLockLogEntry(pydantic.BaseModel):
     wait_queue_pid: tuple[int, ...]
 
 
-def parse_holding_lock_log_line(s: str) -> HoldingLockLogEntry:
+def _parse_holding_lock(s: str) -> tuple[int, tuple[int, ...]]:
     first_pid, _, remaining_pids = (
         get_first_line(s).strip().strip(".").partition(". Wait queue: ")
     )
 
+    return int(first_pid), tuple(int(x) for x in remaining_pids.split(",") if x)
+
+
+def parse_holding_lock_log_line(s: str) -> HoldingLockLogEntry:
+    holding_lock_pid, wait_queue_pid = _parse_holding_lock(s)
+
     return HoldingLockLogEntry(
-        holding_lock_pid=int(first_pid),
-        wait_queue_pid=tuple(int(x) for x in remaining_pids.split(",") if x),
+        holding_lock_pid=holding_lock_pid,
+        wait_queue_pid=wait_queue_pid,
     )
 
 
@@ -319,7 +560,7 @@ class Statement(pydantic.BaseModel):
     end_time: datetime.datetime
     context: LogPrefixInfo
     pid: int
-    log_line_no: int
+    log_line_no: Optional[int]
     statement: str
     duration: float
 
@@ -343,6 +584,50 @@ class Event(pydantic.BaseModel):
     secondary_related_pids: tuple[int, ...] = ()
 
 
+class _StatementRecord(typing.NamedTuple):
+    start_time: datetime.datetime
+    end_time: datetime.datetime
+    context: _PrefixRecord
+    pid: int
+    log_line_no: Optional[int]
+    statement: str
+    duration: float
+
+
+class _EventRecord(typing.NamedTuple):
+    time: datetime.datetime
+    pid: int
+    context: _PrefixRecord
+    event_type: EventType
+    description: Optional[str] = None
+    primary_related_pids: tuple[int, ...] = ()
+    secondary_related_pids: tuple[int, ...] = ()
+
+
+def _statement_from_record(record: _StatementRecord) -> Statement:
+    return Statement.construct(
+        start_time=record.start_time,
+        end_time=record.end_time,
+        context=_prefix_info_from_record(record.context),
+        pid=record.pid,
+        log_line_no=record.log_line_no,
+        statement=record.statement,
+        duration=record.duration,
+    )
+
+
+def _event_from_record(record: _EventRecord) -> Event:
+    return Event.construct(
+        time=record.time,
+        pid=record.pid,
+        context=_prefix_info_from_record(record.context),
+        event_type=record.event_type,
+        description=record.description,
+        primary_related_pids=record.primary_related_pids,
+        secondary_related_pids=record.secondary_related_pids,
+    )
+
+
 class Process(pydantic.BaseModel):
     pid: int
     first_appearance: datetime.datetime
@@ -351,16 +636,41 @@ class Process(pydantic.BaseModel):
 class ProcessSortOrder(str, enum.Enum):
     PID = "pid"
     TIME = "time"
+    # Processes whose lifetimes don't overlap share lanes, in order of time
+    PACKED = "packed"
+
+
+class PayloadFormat(str, enum.Enum):
+    FULL = "full"
+    COMPACT = "compact"
+
+
+class Renderer(str, enum.Enum):
+    # One SVG element per statement and event; fine up to some tens of thousands
+    SVG = "svg"
+    CANVAS = "canvas"
 
 
 class VizOptions(pydantic.BaseModel):
     process_sort_order: ProcessSortOrder = ProcessSortOrder.TIME
+    renderer: Renderer = Renderer.SVG
     timezone: Optional[str] = None
+    # Below this many statements there's no need for aggregated levels of detail
+    # (which only the canvas renderer uses)
+    lod_min_statements: int = 10000
+    payload_format: PayloadFormat = PayloadFormat.COMPACT
+    # gzip and base64 the payload; the viewer inflates it with DecompressionStream,
+    # which needs a browser from 2023 or later.
+    compress_payload: bool = False
+    # Directory in which to keep compiled report templates between runs
+    template_cache_dir: Optional[str] = None
 
 
 class ParseOptions(pydantic.BaseModel):
     log_line_prefix_format: Optional[str] = None
     log_line_prefix_regex: Optional[str] = None
+    infer_log_line_prefix: bool = True
+    jobs: int = 1
 
 
 EVENT_COLOURS = {
@@ -373,12 +683,455 @@ EVENT_COLOURS = {
 }
 
 
+class ParseStats(pydantic.BaseModel):
+    parsed_lines: int = 0
+    # Lines whose prefix wasn't matched by the matcher that matched the line
+    # before it; should stay close to zero unless the prefix format varies.
+    prefix_fallback_lines: int = 0
+    inferred_log_line_prefix: Optional[str] = None
+
+
 class Model(pydantic.BaseModel):
     processes: list[Process]
     statements: list[Statement]
     events: list[Event]
     start_time: datetime.datetime
     end_time: datetime.datetime
+    stats: ParseStats = ParseStats()
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+EVENT_TYPES = list(EventType)
+
+
+def _to_usec(t: datetime.datetime) -> int:
+    if t.tzinfo is None:
+        # Naive timestamps are taken to be local time, as datetime.timestamp does.
+        t = t.astimezone()
+    return (t - EPOCH) // ONE_MICROSECOND
+
+
+class _StringTable:
+    # Stores each distinct string once, handing out stable indices. Index -1
+    # stands for None.
+    __slots__ = ("strings", "indices")
+
+    def __init__(self) -> None:
+        self.strings: list[str] = []
+        self.indices: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def index(self, s: Optional[str]) -> int:
+        if s is None:
+            return -1
+
+        try:
+            return self.indices[s]
+        except KeyError:
+            index = self.indices[s] = len(self.strings)
+            self.strings.append(s)
+            return index
+
+    def get(self, index: int) -> Optional[str]:
+        return self.strings[index] if index >= 0 else None
+
+
+class ColumnarModel:
+    # Holds the same data as Model, but column by column in typed arrays, with
+    # strings stored once in tables and referred to by index. Timestamps are
+    # microseconds since the epoch, and each row keeps the index of the time
+    # zone it was logged in, so that it is converted back to the same local time.
+    __slots__ = (
+        "start_usec",
+        "end_usec",
+        "tzinfos",
+        "tz_indices",
+        "last_tz",
+        "start_tz",
+        "end_tz",
+        "stats",
+        "strings",
+        "texts",
+        "classes",
+        "text_classes",
+        "process_pid",
+        "process_first_appearance_usec",
+        "process_tz",
+        "statement_start_usec",
+        "statement_end_usec",
+        "statement_tz",
+        "statement_pid",
+        "statement_log_line_no",
+        "statement_text",
+        "statement_class",
+        "statement_username",
+        "statement_database",
+        "statement_application_name",
+        "event_time_usec",
+        "event_tz",
+        "event_pid",
+        "event_log_line_no",
+        "event_type",
+        "event_description",
+        "event_username",
+        "event_database",
+        "event_application_name",
+        "event_primary_related_pids",
+        "event_secondary_related_pids",
+    )
+
+    def __init__(
+        self,
+        start_time: datetime.datetime,
+        end_time: datetime.datetime,
+        stats: Optional[ParseStats] = None,
+    ) -> None:
+        # Time zones, keyed by UTC offset and name, with None standing for
+        # naive timestamps in local time
+        self.tzinfos: list[Optional[datetime.tzinfo]] = []
+        self.tz_indices: dict[Optional[tuple[datetime.timedelta, Optional[str]]], int]
+        self.tz_indices = {}
+        # Nearly all rows share one tzinfo object, so it's checked for first
+        self.last_tz: tuple[Optional[datetime.tzinfo], int] = (None, -1)
+
+        self.start_usec = _to_usec(start_time)
+        self.end_usec = _to_usec(end_time)
+        self.start_tz = self.tz_index(start_time)
+        self.end_tz = self.tz_index(end_time)
+        self.stats = stats or ParseStats()
+
+        # Usernames, databases, application names and event descriptions
+        self.strings = _StringTable()
+        # Statement texts, and the index of the class of each
+        self.texts = _StringTable()
+        self.classes = _StringTable()
+        self.text_classes = array.array("i")
+
+        self.process_pid = array.array("i")
+        self.process_first_appearance_usec = array.array("q")
+        self.process_tz = array.array("i")
+
+        self.statement_start_usec = array.array("q")
+        self.statement_end_usec = array.array("q")
+        self.statement_tz = array.array("i")
+        self.statement_pid = array.array("i")
+        self.statement_log_line_no = array.array("q")
+        self.statement_text = array.array("i")
+        self.statement_class = array.array("i")
+        self.statement_username = array.array("i")
+        self.statement_database = array.array("i")
+        self.statement_application_name = array.array("i")
+
+        self.event_time_usec = array.array("q")
+        self.event_tz = array.array("i")
+        self.event_pid = array.array("i")
+        self.event_log_line_no = array.array("q")
+        self.event_type = array.array("b")
+        self.event_description = array.array("i")
+        self.event_username = array.array("i")
+        self.event_database = array.array("i")
+        self.event_application_name = array.array("i")
+        # Nearly always empty, and the empty tuple is shared
+        self.event_primary_related_pids: list[tuple[int, ...]] = []
+        self.event_secondary_related_pids: list[tuple[int, ...]] = []
+
+    def tz_index(self, t: datetime.datetime) -> int:
+        tzinfo = t.tzinfo
+        if tzinfo is not None and tzinfo is self.last_tz[0]:
+            return self.last_tz[1]
+
+        offset = t.utcoffset()
+        key = None if offset is None else (offset, t.tzname())
+        try:
+            index = self.tz_indices[key]
+        except KeyError:
+            index = self.tz_indices[key] = len(self.tzinfos)
+            self.tzinfos.append(None if key is None else tzinfo)
+
+        self.last_tz = (tzinfo, index)
+        return index
+
+    def datetime_from_usec(self, usec: int, tz: int) -> datetime.datetime:
+        t = EPOCH + datetime.timedelta(microseconds=usec)
+        tzinfo = self.tzinfos[tz]
+        if tzinfo is None:
+            return t.astimezone().replace(tzinfo=None)
+        return t.astimezone(tzinfo)
+
+    def tz_changes(self) -> list[tuple[int, int]]:
+        # The times from which on timestamps were logged in another time zone,
+        # starting with the start of the log
+        points = sorted(
+            itertools.chain(
+                [(self.start_usec, self.start_tz)],
+                zip(self.process_first_appearance_usec, self.process_tz),
+                zip(self.statement_end_usec, self.statement_tz),
+                zip(self.event_time_usec, self.event_tz),
+                [(self.end_usec, self.end_tz)],
+            ),
+            key=lambda point: point[0],
+        )
+        changes = points[:1]
+        for usec, tz in points:
+            if tz != changes[-1][1]:
+                changes.append((usec, tz))
+        return changes
+
+    def add_process(self, pid: int, first_appearance: datetime.datetime) -> None:
+        self.process_pid.append(pid)
+        self.process_first_appearance_usec.append(_to_usec(first_appearance))
+        self.process_tz.append(self.tz_index(first_appearance))
+
+    def _text_index(self, text: str) -> int:
+        index = self.texts.index(text)
+        if index == len(self.text_classes):
+            self.text_classes.append(self.classes.index(classify_sql(text)))
+        return index
+
+    def add_statement(
+        self,
+        start_time: datetime.datetime,
+        end_time: datetime.datetime,
+        context: typing.Union[LogPrefixInfo, _PrefixRecord],
+        statement: str,
+    ) -> None:
+        text_index = self._text_index(statement)
+
+        self.statement_start_usec.append(_to_usec(start_time))
+        self.statement_end_usec.append(_to_usec(end_time))
+        self.statement_tz.append(self.tz_index(end_time))
+        self.statement_pid.append(context.pid)
+        self.statement_log_line_no.append(
+            -1 if context.log_line_no is None else context.log_line_no
+        )
+        self.statement_text.append(text_index)
+        self.statement_class.append(self.text_classes[text_index])
+        self.statement_username.append(self.strings.index(context.username))
+        self.statement_database.append(self.strings.index(context.database))
+        self.statement_application_name.append(
+            self.strings.index(context.application_name)
+        )
+
+    def add_event(
+        self,
+        time: datetime.datetime,
+        context: typing.Union[LogPrefixInfo, _PrefixRecord],
+        event_type: EventType,
+        description: Optional[str],
+        primary_related_pids: tuple[int, ...],
+        secondary_related_pids: tuple[int, ...],
+    ) -> None:
+        self.event_time_usec.append(_to_usec(time))
+        self.event_tz.append(self.tz_index(time))
+        self.event_pid.append(context.pid)
+        self.event_log_line_no.append(
+            -1 if context.log_line_no is None else context.log_line_no
+        )
+        self.event_type.append(EVENT_TYPES.index(event_type))
+        self.event_description.append(self.strings.index(description))
+        self.event_username.append(self.strings.index(context.username))
+        self.event_database.append(self.strings.index(context.database))
+        self.event_application_name.append(self.strings.index(context.application_name))
+        self.event_primary_related_pids.append(primary_related_pids or ())
+        self.event_secondary_related_pids.append(secondary_related_pids or ())
+
+    def statement_context(self, i: int) -> _PrefixRecord:
+        log_line_no = self.statement_log_line_no[i]
+        return _make_prefix_record(
+            timestamp=self.datetime_from_usec(
+                self.statement_end_usec[i], self.statement_tz[i]
+            ),
+            pid=self.statement_pid[i],
+            log_line_no=None if log_line_no < 0 else log_line_no,
+            username=self.strings.get(self.statement_username[i]),
+            database=self.strings.get(self.statement_database[i]),
+            application_name=self.strings.get(self.statement_application_name[i]),
+        )
+
+    def event_context(self, i: int) -> _PrefixRecord:
+        log_line_no = self.event_log_line_no[i]
+        return _make_prefix_record(
+            timestamp=self.datetime_from_usec(
+                self.event_time_usec[i], self.event_tz[i]
+            ),
+            pid=self.event_pid[i],
+            log_line_no=None if log_line_no < 0 else log_line_no,
+            username=self.strings.get(self.event_username[i]),
+            database=self.strings.get(self.event_database[i]),
+            application_name=self.strings.get(self.event_application_name[i]),
+        )
+
+    @classmethod
+    def from_model(cls, model: Model) -> "ColumnarModel":
+        rv = cls(model.start_time, model.end_time, model.stats)
+
+        for process in model.processes:
+            rv.add_process(process.pid, process.first_appearance)
+
+        for stmt in model.statements:
+            rv.add_statement(
+                stmt.start_time, stmt.end_time, stmt.context, stmt.statement
+            )
+
+        for evt in model.events:
+            rv.add_event(
+                evt.time,
+                evt.context,
+                evt.event_type,
+                evt.description,
+                evt.primary_related_pids,
+                evt.secondary_related_pids,
+            )
+
+        return rv
+
+    def to_model(self) -> Model:
+        processes = [
+            Process(pid=pid, first_appearance=self.datetime_from_usec(usec, tz))
+            for pid, usec, tz in zip(
+                self.process_pid, self.process_first_appearance_usec, self.process_tz
+            )
+        ]
+
+        statements = []
+        for i, text_index in enumerate(self.statement_text):
+            context = self.statement_context(i)
+            start_time = self.datetime_from_usec(
+                self.statement_start_usec[i], self.statement_tz[i]
+            )
+            end_time = context.timestamp
+            statements.append(
+                _statement_from_record(
+                    _StatementRecord(
+                        start_time=start_time,
+                        end_time=end_time,
+                        context=context,
+                        pid=context.pid,
+                        log_line_no=context.log_line_no,
+                        statement=self.texts.strings[text_index],
+                        duration=(end_time - start_time).total_seconds(),
+                    )
+                )
+            )
+
+        events = []
+        for i, event_type in enumerate(self.event_type):
+            context = self.event_context(i)
+            events.append(
+                _event_from_record(
+                    _EventRecord(
+                        time=context.timestamp,
+                        pid=context.pid,
+                        context=context,
+                        event_type=EVENT_TYPES[event_type],
+                        description=self.strings.get(self.event_description[i]),
+                        primary_related_pids=self.event_primary_related_pids[i],
+                        secondary_related_pids=self.event_secondary_related_pids[i],
+                    )
+                )
+            )
+
+        return Model(
+            processes=processes,
+            statements=statements,
+            events=events,
+            start_time=self.datetime_from_usec(self.start_usec, self.start_tz),
+            end_time=self.datetime_from_usec(self.end_usec, self.end_tz),
+            stats=self.stats,
+        )
+
+    def _arrays(self) -> dict[str, array.array]:
+        return {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if isinstance(getattr(self, name), array.array)
+        }
+
+    def dump(self, f: typing.BinaryIO) -> None:
+        # A line of JSON with everything but the typed arrays, followed by the
+        # raw contents of the arrays in the order listed in it
+        arrays = self._arrays()
+        tz_keys = sorted(self.tz_indices, key=self.tz_indices.__getitem__)
+        header = {
+            "byteorder": sys.byteorder,
+            "start_usec": self.start_usec,
+            "end_usec": self.end_usec,
+            "start_tz": self.start_tz,
+            "end_tz": self.end_tz,
+            "tzinfos": [
+                None if key is None else [key[0].total_seconds(), key[1]]
+                for key in tz_keys
+            ],
+            "stats": self.stats.dict(),
+            "strings": self.strings.strings,
+            "texts": self.texts.strings,
+            "classes": self.classes.strings,
+            "event_primary_related_pids": self.event_primary_related_pids,
+            "event_secondary_related_pids": self.event_secondary_related_pids,
+            "arrays": [[name, a.typecode, len(a)] for name, a in arrays.items()],
+        }
+        f.write(json.dumps(header).encode() + b"\n")
+        for a in arrays.values():
+            f.write(a.tobytes())
+
+    @classmethod
+    def load(cls, f: typing.BinaryIO) -> "ColumnarModel":
+        # Reads what dump() wrote, raising ValueError if it doesn't fit
+        header = json.loads(f.readline())
+
+        rv = cls(EPOCH, EPOCH, ParseStats(**header["stats"]))
+        rv.start_usec = header["start_usec"]
+        rv.end_usec = header["end_usec"]
+        rv.start_tz = header["start_tz"]
+        rv.end_tz = header["end_tz"]
+
+        rv.tzinfos = []
+        rv.tz_indices = {}
+        for entry in header["tzinfos"]:
+            if entry is None:
+                rv.tz_indices[None] = len(rv.tzinfos)
+                rv.tzinfos.append(None)
+            else:
+                seconds, name = entry
+                offset = datetime.timedelta(seconds=seconds)
+                rv.tz_indices[offset, name] = len(rv.tzinfos)
+                rv.tzinfos.append(dateutil.tz.tzoffset(name, offset))
+
+        for table, strings in (
+            (rv.strings, header["strings"]),
+            (rv.texts, header["texts"]),
+            (rv.classes, header["classes"]),
+        ):
+            for value in strings:
+                table.index(value)
+
+        rv.event_primary_related_pids = [
+            tuple(pids) for pids in header["event_primary_related_pids"]
+        ]
+        rv.event_secondary_related_pids = [
+            tuple(pids) for pids in header["event_secondary_related_pids"]
+        ]
+
+        arrays = rv._arrays()
+        if [name for name, _, _ in header["arrays"]] != list(arrays):
+            raise ValueError("Unexpected columns in model")
+        for name, typecode, length in header["arrays"]:
+            column = array.array(typecode)
+            if typecode != arrays[name].typecode:
+                raise ValueError(f"Unexpected type of column {name}")
+            column.frombytes(f.read(length * column.itemsize))
+            if len(column) != length:
+                raise ValueError(f"Column {name} is truncated")
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            setattr(rv, name, column)
+
+        return rv
 
 
 class ProcessVizData(pydantic.BaseModel):
@@ -386,6 +1139,27 @@ class ProcessVizData(pydantic.BaseModel):
     y: int
     height: int
     pid: int
+    # Lifetime of the process, when it shares its lane with others
+    t_offset: Optional[float] = None
+    duration: Optional[float] = None
+
+
+class UtcOffsetVizData(pydantic.BaseModel):
+    # Display offset and time zone abbreviation from start_time_unix_usec on
+    start_time_unix_usec: int
+    offset_seconds: int
+    name: str
+
+
+class ContextVizData(pydantic.BaseModel):
+    pid: int
+    username: Optional[str]
+    database: Optional[str]
+    application_name: Optional[str]
+
+
+# The sidebar content of statements and events is built by the viewer on hover,
+# from these fields and the context and text tables in VizData.
 
 
 class StatementVizData(pydantic.BaseModel):
@@ -396,7 +1170,9 @@ class StatementVizData(pydantic.BaseModel):
     duration: float
     colour: str
     process_element_id: str
-    mouseover_content: str
+    context: int
+    log_line_no: Optional[int]
+    text: int
 
 
 class EventVizData(pydantic.BaseModel):
@@ -407,7 +1183,25 @@ class EventVizData(pydantic.BaseModel):
     colour: str
     primary_related_process_ids: list[str]
     secondary_related_process_ids: list[str]
-    mouseover_content: str
+    event_type: str
+    context: int
+    log_line_no: Optional[int]
+    text: Optional[int]
+
+
+class LodLevelVizData(pydantic.BaseModel):
+    # Statements aggregated per lane and time bucket, one column per field.
+    # Buckets are numbered from the start of the report. Lanes are given by
+    # their y, and process is None for cells with statements of several
+    # processes (which share a lane in the packed layout).
+    bucket_usec: int
+    y: list[int]
+    process: list[Optional[int]]
+    bucket: list[int]
+    count: list[int]
+    max_duration_usec: list[int]
+    colour: list[str]
+    text: list[int]
 
 
 class VizData(pydantic.BaseModel):
@@ -415,6 +1209,8 @@ class VizData(pydantic.BaseModel):
     events: list[EventVizData]
     processes: list[ProcessVizData]
     statements: list[StatementVizData]
+    contexts: list[ContextVizData]
+    texts: list[str]
     total_duration_seconds: float
     total_height: int
     total_duration_string: str
@@ -422,6 +1218,11 @@ class VizData(pydantic.BaseModel):
     end_time_string: str
     start_time_unix_seconds: float
     end_time_unix_seconds: float
+    start_time_unix_usec: int
+    utc_offsets: list[UtcOffsetVizData]
+    renderer: Renderer = Renderer.SVG
+    # Finest level first
+    lod_levels: list[LodLevelVizData] = []
 
 
 def classify_sql(sql: str) -> str:
@@ -457,12 +1258,79 @@ def generate_colours(n: int) -> list[str]:
     return rv
 
 
+DEFAULT_LOG_PREFIX_FORMATS = [
+    "%t [%p-%l] %q%u@%d",
+    "%t [%p-%l] %q%u@%d (%a)",
+    "%m [%p]",
+]
+
 DEFAULT_LOG_PREFIX_MATCHERS = [
-    make_prefix_parser("%t [%p-%l] %q%u@%d"),
-    make_prefix_parser("%t [%p-%l] %q%u@%d (%a)"),
-    make_prefix_parser("%m [%p]"),
+    make_prefix_parser(f) for f in DEFAULT_LOG_PREFIX_FORMATS
 ]
 
+# Candidates for log_line_prefix inference, covering the Postgres default and
+# the defaults of common distributions, hosting providers and tools.
+COMMON_LOG_LINE_PREFIXES = [
+    "%m [%p] ",
+    "%m [%p] %q%u@%d ",
+    "%t [%p-%l] %q%u@%d ",
+    "%t [%p-%l] %q%u@%d (%a) ",
+    "%t [%p]: [%l-1] user=%u,db=%d,app=%a,client=%h ",
+    "%t [%p]: user=%u,db=%d,app=%a,client=%h ",
+    "%m [%p]: [%l-1] db=%d,user=%u ",
+    "%t:%r:%u@%d:[%p]:",
+]
+
+PREFIX_INFERENCE_SAMPLE_LINES = 2000
+
+LOG_SEVERITY_RE = re.compile(
+    r"\b(?:DEBUG[1-5]|INFO|NOTICE|WARNING|ERROR|LOG|FATAL|PANIC"
+    r"|DETAIL|HINT|QUERY|CONTEXT|LOCATION|STATEMENT):  "
+)
+
+
+def infer_log_line_prefix(lines: Iterable[str]) -> Optional[str]:
+    # Picks the candidate prefix format matching the most sampled lines. Ties
+    # go to the candidate that captures the most fields, since e.g. "%m [%p] "
+    # matches a subset of what "%m [%p] %q%u@%d " does.
+    prefixes = []
+    for line in lines:
+        m = LOG_SEVERITY_RE.search(line)
+        if m:
+            prefixes.append(line[: m.start()])
+
+    best: Optional[str] = None
+    best_score = (0, 0)
+
+    for log_line_prefix in COMMON_LOG_LINE_PREFIXES:
+        matcher = _make_prefix_record_parser(log_line_prefix)
+        matched = 0
+        captured = 0
+
+        for prefix in prefixes:
+            try:
+                info = matcher(prefix) or matcher(prefix.strip())
+            except (ValueError, RuntimeError):
+                info = None
+
+            if info:
+                matched += 1
+                captured += sum(
+                    value is not None
+                    for value in (
+                        info.log_line_no,
+                        info.username,
+                        info.database,
+                        info.application_name,
+                    )
+                )
+
+        if (matched, captured) > best_score:
+            best = log_line_prefix
+            best_score = (matched, captured)
+
+    return best
+
 
 def parse_log_prefix(
     prefix: str, matchers: Optional[list[Callable]] = None
@@ -481,7 +1349,33 @@ def parse_log_prefix(
     raise ValueError(f"Log prefix {repr(prefix)} not matched by any known pattern")
 
 
-def parse_duration_log_line(line: str) -> Optional[DurationLogEntry]:
+PrefixT = typing.TypeVar("PrefixT")
+
+
+def make_adaptive_prefix_parser(
+    matchers: list[Callable[[str], Optional[PrefixT]]],
+    on_fallback: Callable[[], None],
+) -> Callable[[str], PrefixT]:
+    # Tries the same matchers as parse_log_prefix, but the prefix format of a
+    # file practically never changes, so whichever matcher matched last is
+    # moved to the front and normally the only one tried.
+    candidates = list(matchers)
+
+    def apply(prefix: str) -> PrefixT:
+        for i, matcher in enumerate(candidates):
+            rv = matcher(prefix) or matcher(prefix.strip())
+            if rv:
+                if i:
+                    on_fallback()
+                    candidates.insert(0, candidates.pop(i))
+                return rv
+
+        raise ValueError(f"Log prefix {repr(prefix)} not matched by any known pattern")
+
+    return apply
+
+
+def _parse_duration(line: str) -> tuple[int, Optional[str]]:
     line = get_first_line(line).strip()
 
     m = DURATION_LINE_RE.match(line)
@@ -489,50 +1383,82 @@ def parse_duration_log_line(line: str) -> Optional[DurationLogEntry]:
         duration_usec = m.group(1).replace(".", "")
         statement = m.group(2)
 
-        return DurationLogEntry(
-            duration_usec=int(duration_usec),
-            statement=statement,
-        )
+        return int(duration_usec), statement
 
     m = DURATION_LINE_WITHOUT_STATEMENT_RE.match(line)
     if m:
         duration_usec = m.group(1).replace(".", "")
 
-        return DurationLogEntry(
-            duration_usec=int(duration_usec),
-            statement=None,
-        )
+        return int(duration_usec), None
 
     raise RuntimeError(f"Malformed duration log line: {line}")
 
 
-def create_statement(context: LogPrefixInfo, entry: DurationLogEntry) -> Statement:
-    duration = datetime.timedelta(microseconds=entry.duration_usec)
+def parse_duration_log_line(line: str) -> Optional[DurationLogEntry]:
+    duration_usec, statement = _parse_duration(line)
+
+    return DurationLogEntry(
+        duration_usec=duration_usec,
+        statement=statement,
+    )
+
+
+def _create_statement_record(
+    context: _PrefixRecord, duration_usec: int, statement: Optional[str]
+) -> _StatementRecord:
+    duration = datetime.timedelta(microseconds=duration_usec)
     t1 = context.timestamp
     t0 = context.timestamp - duration
 
-    return Statement(
+    return _StatementRecord(
         start_time=t0,
         end_time=t1,
         context=context,
         duration=duration.total_seconds(),
         pid=context.pid,
         log_line_no=context.log_line_no,
-        statement=entry.statement or "",
+        statement=statement or "",
     )
 
 
-def make_data_table_renderer() -> Callable[[DataTable], str]:
-    env = jinja2.Environment(
-        loader=jinja2.FunctionLoader(
-            lambda name: pkg_resources.resource_string(
-                "pg_lupa.resources", name
-            ).decode()
-        ),
+def create_statement(context: LogPrefixInfo, entry: DurationLogEntry) -> Statement:
+    return _statement_from_record(
+        _create_statement_record(
+            _make_prefix_record(**context.dict()), entry.duration_usec, entry.statement
+        )
+    )
+
+
+def _load_template_source(name: str) -> str:
+    import importlib.resources
+
+    return importlib.resources.files("pg_lupa.resources").joinpath(name).read_text()
+
+
+@functools.lru_cache(maxsize=None)
+def _template_environment(
+    bytecode_cache_dir: Optional[str] = None,
+) -> "jinja2.Environment":
+    import jinja2
+
+    # Shared between reports, so that each template is only compiled once per
+    # process. With a cache directory, compiled templates are also kept on disk
+    # for later processes.
+    bytecode_cache = None
+    if bytecode_cache_dir:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+
+    return jinja2.Environment(
+        loader=jinja2.FunctionLoader(_load_template_source),
         autoescape=True,
+        auto_reload=False,
+        bytecode_cache=bytecode_cache,
     )
 
-    tmpl = env.get_template("context.template.html")
+
+def make_data_table_renderer() -> Callable[[DataTable], str]:
+    tmpl = _template_environment().get_template("context.template.html")
 
     def render_data_table(table: DataTable) -> str:
         return tmpl.render(table=table)
@@ -541,7 +1467,7 @@ def make_data_table_renderer() -> Callable[[DataTable], str]:
 
 
 def make_data_table(
-    context: LogPrefixInfo,
+    context: typing.Union[LogPrefixInfo, _PrefixRecord],
     *,
     rows: Optional[list[DataRow]] = None,
     text: Optional[str] = None,
@@ -598,167 +1524,672 @@ def make_data_table(
     return table
 
 
-def visualize(model: Model, out: typing.TextIO, options: Optional[VizOptions] = None):
+LOD_FINEST_BUCKETS = 2048
+LOD_COARSEST_BUCKETS = 128
+
+
+class _LodCell:
+    __slots__ = ("process", "started", "in_progress", "max_duration", "busy")
+
+    def __init__(self) -> None:
+        # The one process whose statements are in the cell, or -1 if there are
+        # several
+        self.process: Optional[int] = None
+        self.started = 0
+        # Statements that started in an earlier bucket and are still running
+        self.in_progress = 0
+        self.max_duration = 0
+        # Time spent per statement class
+        self.busy: dict[int, int] = {}
+
+    def add_busy(self, process: int, cls: int, usec: int) -> None:
+        if self.process is None:
+            self.process = process
+        elif self.process != process:
+            self.process = -1
+        self.busy[cls] = self.busy.get(cls, 0) + usec
+
+    def busiest(self) -> int:
+        return max(self.busy, key=self.busy.__getitem__)
+
+
+def _make_lod_level(
+    statements: list[tuple[int, int, int, int, int]],
+    start_usec: int,
+    end_usec: int,
+    buckets: int,
+) -> tuple[int, dict[tuple[int, int], _LodCell]]:
+    bucket_usec = max(-(-(end_usec - start_usec) // buckets), 1)
+    cells: dict[tuple[int, int], _LodCell] = collections.defaultdict(_LodCell)
+
+    for lane, process, start, end, cls in statements:
+        duration = end - start
+        first = (start - start_usec) // bucket_usec
+        last = (end - start_usec - 1) // bucket_usec
+
+        if last <= first:
+            cell = cells[lane, first]
+            cell.started += 1
+            if duration > cell.max_duration:
+                cell.max_duration = duration
+            cell.add_busy(process, cls, duration)
+            continue
+
+        for bucket in range(first, last + 1):
+            cell = cells[lane, bucket]
+            if bucket == first:
+                cell.started += 1
+            else:
+                cell.in_progress += 1
+            if duration > cell.max_duration:
+                cell.max_duration = duration
+            bucket_start = start_usec + bucket * bucket_usec
+            cell.add_busy(
+                process,
+                cls,
+                min(end, bucket_start + bucket_usec) - max(start, bucket_start),
+            )
+
+    return bucket_usec, dict(cells)
+
+
+def _make_lod_pyramid(
+    statements: list[tuple[int, int, int, int, int]],
+    start_usec: int,
+    end_usec: int,
+    max_cells: int,
+) -> list[tuple[int, dict[tuple[int, int], _LodCell]]]:
+    # Takes (lane, process, start, end, class) per statement and returns, finest
+    # first, (bucket width, cells by (lane, bucket)) per level. Levels are built
+    # from coarse to fine, until one would have more than max_cells cells, as
+    # from there on drawing the statements themselves is about as cheap.
+    levels = []
+    buckets = LOD_COARSEST_BUCKETS
+
+    while buckets <= LOD_FINEST_BUCKETS:
+        level = _make_lod_level(statements, start_usec, end_usec, buckets)
+        if len(level[1]) > max_cells:
+            break
+        levels.append(level)
+        buckets *= 2
+
+    return levels[::-1]
+
+
+def _pack_lanes(lifetimes: list[tuple[int, int]]) -> list[int]:
+    """
+    Assigns (start, end) intervals, sorted by start, to as few lanes as
+    possible without any two overlapping in a lane. Returns the lane of each.
+    """
+    lanes = []
+    # (end of the last interval in the lane, lane) for every lane
+    ends: list[tuple[int, int]] = []
+    for start, end in lifetimes:
+        if ends and ends[0][0] < start:
+            _, lane = heapq.heapreplace(ends, (end, ends[0][1]))
+        else:
+            lane = len(ends)
+            heapq.heappush(ends, (end, lane))
+        lanes.append(lane)
+    return lanes
+
+
+def _utc_offset_segments(
+    to_datetime: Callable[[int], datetime.datetime],
+    start_usec: int,
+    end_usec: int,
+    breaks: Iterable[int] = (),
+) -> list[tuple[int, int, str]]:
+    # Finds where the UTC offset or zone name of the displayed times changes,
+    # so that the viewer can format times exactly like strftime() does. Changes
+    # can be anywhere at the given breaks, and at most once a day in between.
+    def offset_at(usec: int) -> tuple[int, str]:
+        t = to_datetime(usec)
+        offset = t.utcoffset() if t.tzinfo else t.astimezone().utcoffset()
+        assert offset is not None
+        return int(offset.total_seconds()), t.strftime("%Z")
+
+    segments = [(start_usec, *offset_at(start_usec))]
+
+    step = 86400 * 1000000
+    bounds = {*range(start_usec + step, end_usec, step), end_usec}
+    bounds.update(usec for usec in breaks if start_usec < usec < end_usec)
+
+    lo = start_usec
+    for hi in sorted(bounds):
+        if offset_at(hi) != segments[-1][1:]:
+            a, b = lo, hi
+            while b - a > 1:
+                mid = (a + b) // 2
+                if offset_at(mid) == segments[-1][1:]:
+                    a = mid
+                else:
+                    b = mid
+            segments.append((b, *offset_at(b)))
+        lo = hi
+
+    return segments
+
+
+def visualize(
+    model: typing.Union[Model, ColumnarModel],
+    out: typing.TextIO,
+    options: Optional[VizOptions] = None,
+):
     options = options or VizOptions()
 
+    if isinstance(model, Model):
+        model = ColumnarModel.from_model(model)
+
     tz = dateutil.tz.gettz(options.timezone) if options.timezone else None
 
     timestamp_format = "%Y-%m-%d %H:%M:%S.%f %Z"
 
-    def format_datetime(t: datetime.datetime) -> str:
-        if tz:
-            t = t.astimezone(tz)
-        return t.strftime(timestamp_format)
+    tz_changes = model.tz_changes()
+    tz_change_usecs = [usec for usec, _ in tz_changes]
 
-    render_data_table = make_data_table_renderer()
+    def local_datetime(usec: int) -> datetime.datetime:
+        # In the time zone the log was in at the time
+        k = max(bisect.bisect_right(tz_change_usecs, usec) - 1, 0)
+        return model.datetime_from_usec(usec, tz_changes[k][1])
+
+    def display_datetime(t: datetime.datetime) -> datetime.datetime:
+        return t.astimezone(tz) if tz else t
+
+    def format_datetime(t: datetime.datetime) -> str:
+        return display_datetime(t).strftime(timestamp_format)
 
-    statements = list(model.statements)
+    starts = model.statement_start_usec
+    ends = model.statement_end_usec
 
-    processes = list(model.processes)
-    processes.sort(
+    # From first appearance (or the start of the first statement, which is
+    # logged when it ends) to the last statement or event it is part of, e.g.
+    # disconnecting
+    first_appearances = dict(
+        zip(model.process_pid, model.process_first_appearance_usec)
+    )
+    lifetimes = {pid: [usec, usec] for pid, usec in first_appearances.items()}
+    for pid, start, end in zip(model.statement_pid, starts, ends):
+        lifetime = lifetimes[pid]
+        lifetime[0] = min(lifetime[0], start)
+        lifetime[1] = max(lifetime[1], end)
+    # Processes named in an event, e.g. one holding a lock while idle in a
+    # transaction, are alive at least until then, even if they log nothing more
+    for pid, usec, primary, secondary in zip(
+        model.event_pid,
+        model.event_time_usec,
+        model.event_primary_related_pids,
+        model.event_secondary_related_pids,
+    ):
+        for related_pid in (pid, *primary, *secondary):
+            lifetime = lifetimes[related_pid]
+            lifetime[1] = max(lifetime[1], usec)
+
+    packed = options.process_sort_order == ProcessSortOrder.PACKED
+    processes = sorted(
+        lifetimes,
         key={
-            ProcessSortOrder.PID: lambda p: p.pid,
-            ProcessSortOrder.TIME: lambda p: (p.first_appearance, p.pid),
-        }[options.process_sort_order]
+            ProcessSortOrder.PID: lambda pid: pid,
+            ProcessSortOrder.TIME: lambda pid: (first_appearances[pid], pid),
+            ProcessSortOrder.PACKED: lambda pid: (lifetimes[pid][0], pid),
+        }[options.process_sort_order],
     )
 
-    pids = {process.pid: i for i, process in enumerate(processes)}
+    pids = {pid: i for i, pid in enumerate(processes)}
+    lanes = pids
+    if packed:
+        spans = [(lifetimes[p][0], lifetimes[p][1]) for p in processes]
+        lanes = dict(zip(processes, _pack_lanes(spans)))
+
+    order = sorted(range(len(starts)), key=starts.__getitem__)
 
-    statements.sort(key=lambda x: x.start_time)
+    min_usec = min(min(starts, default=model.start_usec), model.start_usec)
+    max_usec = model.end_usec
 
-    min_time_dt = min(min(x.start_time for x in statements), model.start_time)
-    max_time_dt = model.end_time
+    min_time_dt = local_datetime(min_usec)
+    max_time_dt = model.datetime_from_usec(max_usec, model.end_tz)
 
-    min_time = min_time_dt.timestamp()
-    max_time = max_time_dt.timestamp()
+    # Offsets and durations for all elements, computed over the columns at once
+    statement_offsets = [(starts[i] - min_usec) / 1e6 for i in order]
+    statement_durations = [(ends[i] - starts[i]) / 1e6 for i in order]
+    event_offsets = [(t - min_usec) / 1e6 for t in model.event_time_usec]
 
     bar_height = 10
 
+    contexts: dict[tuple[int, int, int, int], int] = {}
+
+    def context_index(pid: int, username: int, database: int, app: int) -> int:
+        key = (pid, username, database, app)
+        try:
+            return contexts[key]
+        except KeyError:
+            index = contexts[key] = len(contexts)
+            return index
+
+    texts = _StringTable()
+
     rec = VizData(
         title=f"{format_datetime(min_time_dt)} to {format_datetime(max_time_dt)}",
         statements=[],
         processes=[],
         events=[],
-        total_duration_seconds=max_time - min_time,
-        total_duration_string=format_duration(max_time_dt - min_time_dt),
+        contexts=[],
+        texts=[],
+        total_duration_seconds=(max_usec - min_usec) / 1e6,
+        total_duration_string=format_duration(
+            datetime.timedelta(microseconds=max_usec - min_usec)
+        ),
         start_time_string=format_datetime(min_time_dt),
         end_time_string=format_datetime(max_time_dt),
-        start_time_unix_seconds=min_time_dt.timestamp(),
-        end_time_unix_seconds=max_time_dt.timestamp(),
-        total_height=len(pids) * bar_height,
+        start_time_unix_seconds=min_usec / 1e6,
+        end_time_unix_seconds=max_usec / 1e6,
+        start_time_unix_usec=min_usec,
+        renderer=options.renderer,
+        total_height=(max(lanes.values(), default=-1) + 1) * bar_height,
+        utc_offsets=[
+            UtcOffsetVizData(
+                start_time_unix_usec=usec, offset_seconds=offset, name=name
+            )
+            for usec, offset, name in _utc_offset_segments(
+                lambda usec: display_datetime(local_datetime(usec)),
+                min_usec,
+                max_usec,
+                tz_change_usecs,
+            )
+        ],
     )
 
-    for pid, index in pids.items():
+    for pid in pids:
+        start, end = lifetimes[pid]
         rec.processes.append(
             ProcessVizData(
                 id=f"process_{pid}",
-                y=index * bar_height,
+                y=lanes[pid] * bar_height,
                 height=bar_height,
                 pid=pid,
+                t_offset=(start - min_usec) / 1e6 if packed else None,
+                duration=(end - start) / 1e6 if packed else None,
             )
         )
 
-    for i, evt in enumerate(model.events):
+    for i, event_type_index in enumerate(model.event_type):
+        pid = model.event_pid[i]
+        log_line_no = model.event_log_line_no[i]
+        description = model.strings.get(model.event_description[i])
+        event_type = EVENT_TYPES[event_type_index]
         rec.events.append(
             EventVizData(
                 id=f"event_{i+1}",
-                t_offset=evt.time.timestamp() - min_time,
-                cy=pids[evt.pid] * bar_height + 0.5 * bar_height,
+                t_offset=event_offsets[i],
+                cy=lanes[pid] * bar_height + 0.5 * bar_height,
                 size=0.4 * bar_height,
-                mouseover_content=render_data_table(
-                    make_data_table(
-                        evt.context,
-                        text=evt.description,
-                        rows=[
-                            DataRow(
-                                label="Time",
-                                value=format_datetime(evt.time),
-                            ),
-                            DataRow(
-                                label="Event",
-                                value=evt.event_type.value,
-                            ),
-                        ],
-                    )
-                ),
-                colour=EVENT_COLOURS[evt.event_type],
+                colour=EVENT_COLOURS[event_type],
                 primary_related_process_ids=[
-                    f"process_{pid}" for pid in evt.primary_related_pids
+                    f"process_{pid}" for pid in model.event_primary_related_pids[i]
                 ],
                 secondary_related_process_ids=[
-                    f"process_{pid}" for pid in evt.secondary_related_pids
+                    f"process_{pid}" for pid in model.event_secondary_related_pids[i]
                 ],
+                event_type=event_type.value,
+                context=context_index(
+                    pid,
+                    model.event_username[i],
+                    model.event_database[i],
+                    model.event_application_name[i],
+                ),
+                log_line_no=None if log_line_no < 0 else log_line_no,
+                text=texts.index(description) if description else None,
             )
         )
 
-    classes = set()
-    for stmt in statements:
-        classes.add(classify_sql(stmt.statement))
-
-    colours = {}
-    for cls, col in zip(sorted(classes), generate_colours(len(classes))):
-        colours[cls] = col
-
-    for i, stmt in enumerate(statements):
-        name = f"stmt{i+1}"
-        col = colours[classify_sql(stmt.statement)]
-        t0 = stmt.start_time.timestamp()
-        t1 = stmt.end_time.timestamp()
+    classes = model.classes.strings
+    class_colours = [""] * len(classes)
+    for class_index, col in zip(
+        sorted(range(len(classes)), key=classes.__getitem__),
+        generate_colours(len(classes)),
+    ):
+        class_colours[class_index] = col
+
+    for n, i in enumerate(order):
+        pid = model.statement_pid[i]
+        log_line_no = model.statement_log_line_no[i]
         rec.statements.append(
             StatementVizData(
-                id=name,
-                t_offset=t0 - min_time,
-                y=pids[stmt.pid] * bar_height,
+                id=f"stmt{n+1}",
+                t_offset=statement_offsets[n],
+                y=lanes[pid] * bar_height,
                 height=bar_height,
-                duration=t1 - t0,
-                colour=col,
-                process_element_id=f"process_{stmt.pid}",
-                mouseover_content=render_data_table(
-                    make_data_table(
-                        stmt.context,
-                        text=stmt.statement,
-                        rows=[
-                            DataRow(
-                                label="Start",
-                                value=format_datetime(stmt.start_time),
-                            ),
-                            DataRow(
-                                label="End",
-                                value=format_datetime(stmt.end_time),
-                            ),
-                            DataRow(
-                                label="Duration",
-                                value=format_duration(stmt.end_time - stmt.start_time),
-                            ),
-                        ],
-                    )
+                duration=statement_durations[n],
+                colour=class_colours[model.statement_class[i]],
+                process_element_id=f"process_{pid}",
+                context=context_index(
+                    pid,
+                    model.statement_username[i],
+                    model.statement_database[i],
+                    model.statement_application_name[i],
                 ),
+                log_line_no=None if log_line_no < 0 else log_line_no,
+                text=texts.index(model.texts.strings[model.statement_text[i]]),
             )
         )
 
-    out.write(render_html(rec))
+    # Only the canvas renderer draws aggregated levels of detail
+    if options.renderer == Renderer.CANVAS and len(order) >= options.lod_min_statements:
+        pyramid = _make_lod_pyramid(
+            [
+                (
+                    lanes[model.statement_pid[i]],
+                    pids[model.statement_pid[i]],
+                    starts[i],
+                    ends[i],
+                    model.statement_class[i],
+                )
+                for i in order
+            ],
+            min_usec,
+            max_usec,
+            max_cells=len(order) // 2,
+        )
+        for bucket_usec, cells in pyramid:
+            level = LodLevelVizData(
+                bucket_usec=bucket_usec,
+                y=[],
+                process=[],
+                bucket=[],
+                count=[],
+                max_duration_usec=[],
+                colour=[],
+                text=[],
+            )
+            for (lane, bucket), cell in sorted(cells.items()):
+                busiest = cell.busiest()
+                level.y.append(lane * bar_height)
+                level.process.append(cell.process if cell.process != -1 else None)
+                level.bucket.append(bucket)
+                level.count.append(cell.started + cell.in_progress)
+                level.max_duration_usec.append(cell.max_duration)
+                level.colour.append(class_colours[busiest])
+                level.text.append(texts.index(classes[busiest]))
+            rec.lod_levels.append(level)
+
+    rec.contexts = [
+        ContextVizData(
+            pid=pid,
+            username=model.strings.get(username),
+            database=model.strings.get(database),
+            application_name=model.strings.get(app),
+        )
+        for pid, username, database, app in contexts
+    ]
+    rec.texts = texts.strings
+
+    out.write(
+        render_html(
+            rec,
+            payload_format=options.payload_format,
+            compress_payload=options.compress_payload,
+            template_cache_dir=options.template_cache_dir,
+        )
+    )
 
 
-def render_html(data: VizData) -> str:
-    env = jinja2.Environment(
-        loader=jinja2.FunctionLoader(
-            lambda name: pkg_resources.resource_string(
-                "pg_lupa.resources", name
-            ).decode()
+def make_compact_payload(data: VizData) -> dict[str, typing.Any]:
+    # One array per field instead of one object per element, with processes,
+    # colours and event types referred to by index. Element ids are left out;
+    # the viewer numbers elements in order, the same way visualize() does.
+    processes = {process.id: i for i, process in enumerate(data.processes)}
+    colours = _StringTable()
+    event_types = _StringTable()
+
+    return {
+        "format": PayloadFormat.COMPACT.value,
+        **data.dict(
+            exclude={
+                "events",
+                "processes",
+                "statements",
+                "contexts",
+                "utc_offsets",
+                "lod_levels",
+            }
         ),
-        autoescape=True,
-    )
+        "utc_offsets": [offset.dict() for offset in data.utc_offsets],
+        "processes": {
+            "pid": [p.pid for p in data.processes],
+            "y": [p.y for p in data.processes],
+            "height": [p.height for p in data.processes],
+            "t_offset_usec": [
+                None if p.t_offset is None else round(p.t_offset * 1e6)
+                for p in data.processes
+            ],
+            "duration_usec": [
+                None if p.duration is None else round(p.duration * 1e6)
+                for p in data.processes
+            ],
+        },
+        "contexts": {
+            "pid": [c.pid for c in data.contexts],
+            "username": [c.username for c in data.contexts],
+            "database": [c.database for c in data.contexts],
+            "application_name": [c.application_name for c in data.contexts],
+        },
+        "statements": {
+            "t_offset_usec": [round(s.t_offset * 1e6) for s in data.statements],
+            "duration_usec": [round(s.duration * 1e6) for s in data.statements],
+            "y": [s.y for s in data.statements],
+            "height": [s.height for s in data.statements],
+            "colour": [colours.index(s.colour) for s in data.statements],
+            "process": [processes[s.process_element_id] for s in data.statements],
+            "context": [s.context for s in data.statements],
+            "log_line_no": [s.log_line_no for s in data.statements],
+            "text": [s.text for s in data.statements],
+        },
+        "events": {
+            "t_offset_usec": [round(e.t_offset * 1e6) for e in data.events],
+            "cy": [e.cy for e in data.events],
+            "size": [e.size for e in data.events],
+            "colour": [colours.index(e.colour) for e in data.events],
+            "primary_related_processes": [
+                [processes[id] for id in e.primary_related_process_ids]
+                for e in data.events
+            ],
+            "secondary_related_processes": [
+                [processes[id] for id in e.secondary_related_process_ids]
+                for e in data.events
+            ],
+            "event_type": [event_types.index(e.event_type) for e in data.events],
+            "context": [e.context for e in data.events],
+            "log_line_no": [e.log_line_no for e in data.events],
+            "text": [e.text for e in data.events],
+        },
+        "lod_levels": [
+            {
+                **level.dict(exclude={"colour"}),
+                "colour": [colours.index(colour) for colour in level.colour],
+            }
+            for level in data.lod_levels
+        ],
+        "colours": colours.strings,
+        "event_types": event_types.strings,
+    }
+
+
+# Embedded JSON mustn't be able to end the <script> element it's in, or be
+# misread by older parsers; these characters only occur in its strings.
+SCRIPT_JSON_ESCAPES = str.maketrans(
+    {
+        "<": "\\u003c",
+        ">": "\\u003e",
+        "&": "\\u0026",
+        "\u2028": "\\u2028",
+        "\u2029": "\\u2029",
+    }
+)
+
 
-    tmpl = env.get_template("lupa.template.html")
+def escape_json_for_script(s: str) -> str:
+    return s.translate(SCRIPT_JSON_ESCAPES)
+
+
+def render_html(
+    data: VizData,
+    payload_format: PayloadFormat = PayloadFormat.COMPACT,
+    compress_payload: bool = False,
+    template_cache_dir: Optional[str] = None,
+) -> str:
+    tmpl = _template_environment(template_cache_dir).get_template("lupa.template.html")
+
+    if payload_format == PayloadFormat.COMPACT:
+        embeddable_data = escape_json_for_script(
+            json.dumps(make_compact_payload(data), separators=(",", ":"))
+        )
+    else:
+        embeddable_data = escape_json_for_script(data.json(indent=2))
+
+    embeddable_data_encoding = None
+    if compress_payload:
+        embeddable_data = base64.b64encode(
+            gzip.compress(embeddable_data.encode(), mtime=0)
+        ).decode()
+        embeddable_data_encoding = "gzip+base64"
 
     return tmpl.render(
-        embeddable_data=data.json(indent=2),
+        embeddable_data=embeddable_data,
+        embeddable_data_encoding=embeddable_data_encoding,
         lupa_version=__version__,
         report=data,
     )
 
 
-def ingest_logs_google_json(records):
+class CarrierFormat(str, enum.Enum):
+    PLAIN = "plain"
+    GOOGLE_JSON = "google-json"
+    JSON_LINES = "json-lines"
+
+
+CARRIER_SNIFF_SIZE = 8192
+
+JSON_ARRAY_START_RE = re.compile(r"^\[\s*(?:[{\]]|$)")
+
+
+def sniff_carrier_format(header: str) -> CarrierFormat:
+    content = header.lstrip("\ufeff \t\r\n")
+
+    # A bare "[" is not enough: log_line_prefix may well start with a bracket.
+    if JSON_ARRAY_START_RE.match(content):
+        return CarrierFormat.GOOGLE_JSON
+
+    if content.startswith("{"):
+        first_line, newline, _ = content.partition("\n")
+        if not newline and len(header) >= CARRIER_SNIFF_SIZE:
+            # First record is longer than the header; judge by its opening.
+            if first_line.startswith('{"'):
+                return CarrierFormat.JSON_LINES
+        else:
+            try:
+                record = json.loads(first_line)
+            except json.decoder.JSONDecodeError:
+                pass
+            else:
+                if isinstance(record, dict):
+                    return CarrierFormat.JSON_LINES
+
+    return CarrierFormat.PLAIN
+
+
+JSON_READ_CHUNK_SIZE = 65536
+
+JSON_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+
+
+def _skip_json_whitespace(s: str, pos: int) -> int:
+    m = JSON_WHITESPACE_RE.match(s, pos)
+    assert m
+    return m.end()
+
+
+def iter_json_array(
+    header: str, f: typing.TextIO, chunk_size: int = JSON_READ_CHUNK_SIZE
+) -> Iterator[typing.Any]:
+    # Yields the elements of a top-level JSON array one at a time, so memory is
+    # bounded by the largest element rather than by the whole document.
+    decoder = json.JSONDecoder()
+
+    buf = header.lstrip("\ufeff")
+    pos = 0
+    eof = False
+    read_size = chunk_size
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        chunk = f.read(read_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def next_char() -> str:
+        nonlocal pos
+        while True:
+            pos = _skip_json_whitespace(buf, pos)
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                return ""
+
+    def expect(chars: str) -> str:
+        nonlocal pos
+        ch = next_char()
+        if not ch or ch not in chars:
+            wanted = " or ".join(repr(c) for c in chars)
+            raise json.decoder.JSONDecodeError(f"Expecting {wanted}", buf, pos)
+        pos += 1
+        return ch
+
+    def decode_element() -> typing.Any:
+        nonlocal pos, read_size
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.decoder.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # Only trust the element once its delimiter is in the buffer: a
+                # number at the end of the buffer may have been cut short.
+                after = _skip_json_whitespace(buf, end)
+                if eof or (after < len(buf) and buf[after] in ",]"):
+                    pos = end
+                    read_size = chunk_size
+                    return value
+
+            # Element spans the end of the buffer. Grow reads geometrically so
+            # that very large elements are not re-decoded too many times.
+            read_size = max(read_size, len(buf) - pos)
+            fill()
+
+    expect("[")
+
+    if next_char() == "]":
+        pos += 1
+    else:
+        while True:
+            yield decode_element()
+            if expect(",]") == "]":
+                break
+
+    if next_char():
+        raise json.decoder.JSONDecodeError("Extra data", buf, pos)
+
+
+def _line_from_record(record: _LineRecord) -> LogLine:
+    return LogLine.construct(timestamp=record.timestamp, line=record.line)
+
+
+def _ingest_google_json_records(records) -> Iterator[_LineRecord]:
     carriage_return = "\r"
 
     for record in records:
@@ -769,22 +2200,30 @@ def ingest_logs_google_json(records):
         if carriage_return in line:
             line = line[line.index(carriage_return) + 1 :]
 
-        yield LogLine(
-            timestamp=timestamp,
-            line=line,
-        )
+        yield _LineRecord(timestamp, line)
 
 
-def split_simple_lines(data: str) -> list[LogLine]:
-    rv = []
+def ingest_logs_google_json(records):
+    for record in _ingest_google_json_records(records):
+        yield _line_from_record(record)
+
 
-    for line in data.strip().splitlines():
+def _iter_simple_records(lines: Iterable[str]) -> Iterator[_LineRecord]:
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
         if not line.strip():
             continue
 
-        rv.append(LogLine(line=line))
+        yield _LineRecord(None, line, line_no)
+
+
+def iter_simple_lines(lines: Iterable[str]) -> Iterator[LogLine]:
+    for record in _iter_simple_records(lines):
+        yield _line_from_record(record)
 
-    return rv
+
+def split_simple_lines(data: str) -> list[LogLine]:
+    return list(iter_simple_lines(data.strip().splitlines()))
 
 
 def get_first_line(full_entry: str) -> str:
@@ -794,52 +2233,244 @@ def get_first_line(full_entry: str) -> str:
     return full_entry.splitlines()[0]
 
 
-def parse_postgres_lines(
-    lines: list[LogLine], options: Optional[ParseOptions] = None
-) -> Model:
-    options = options or ParseOptions()
+# The log messages that the parser acts on; anything else in a log is skipped
+DISPATCH_KEYS = (
+    "LOG:  duration: ",
+    "LOG:  disconnection: ",
+    "LOG:  connection authorized: ",
+    "DETAIL:  Process holding the lock: ",
+    "ERROR:  deadlock detected",
+    "LOG:  automatic analyze of ",
+    "LOG:  automatic vacuum of ",
+)
+
+
+def _make_dispatch_regex(keys: Iterable[str]) -> tuple[str, list[str]]:
+    # Each key has the form "SEVERITY:  message". Instead of scanning every line
+    # once per key, the keys are compiled into one regex starting with the
+    # literal ":  ", which the regex engine can search for quickly, with the
+    # severity checked by a lookbehind. Lines are thus scanned only once.
+    # Returns the regex and the severity matched by each of its groups.
+    messages_by_severity: dict[str, list[str]] = {}
+
+    for key in keys:
+        severity, separator, message = key.partition(":  ")
+        if not severity or not separator:
+            raise ValueError(f"Dispatch key {repr(key)} lacks a severity")
+        messages_by_severity.setdefault(severity, []).append(message)
+
+    regex = (
+        ":  (?:"
+        + "|".join(
+            f"(?<={re.escape(severity)}:  )("
+            + "|".join(re.escape(message) for message in messages)
+            + ")"
+            for severity, messages in messages_by_severity.items()
+        )
+        + ")"
+    )
+    return regex, list(messages_by_severity)
+
+
+def make_dispatch_matcher(
+    keys: Iterable[str],
+) -> Callable[[str], Optional[tuple[str, str, str]]]:
+    regex, severities = _make_dispatch_regex(keys)
+    compiled_regex = re.compile(regex)
+
+    def apply(s: str) -> Optional[tuple[str, str, str]]:
+        m = compiled_regex.search(s)
+        if not m:
+            return None
+
+        assert m.lastindex
+        start = m.start() - len(severities[m.lastindex - 1])
+
+        return s[:start], s[start : m.end()], s[m.end() :]
+
+    return apply
+
+
+class _ParseState:
+    # Intermediate result of parsing some consecutive log lines. States from
+    # consecutive chunks of input can be merged, which is what allows parsing
+    # to be split across processes.
+    __slots__ = (
+        "stmts_by_process",
+        "events",
+        "pids_by_first_seen",
+        "start_time",
+        "end_time",
+        "parsed_lines",
+        "prefix_fallback_lines",
+    )
+
+    def __init__(self) -> None:
+        self.stmts_by_process: dict[int, list[_StatementRecord]] = {}
+        self.events: list[_EventRecord] = []
+        self.pids_by_first_seen: dict[int, datetime.datetime] = {}
+        self.start_time: Optional[datetime.datetime] = None
+        self.end_time: Optional[datetime.datetime] = None
+        self.parsed_lines = 0
+        self.prefix_fallback_lines = 0
+
+    def saw_pid_at(self, pid: int, t: datetime.datetime) -> None:
+        try:
+            old_time = self.pids_by_first_seen[pid]
+        except KeyError:
+            self.pids_by_first_seen[pid] = t
+        else:
+            if old_time > t:
+                self.pids_by_first_seen[pid] = t
+
+    def saw_timestamp(self, t: datetime.datetime) -> None:
+        if self.start_time is None or t < self.start_time:
+            self.start_time = t
+        if self.end_time is None or t > self.end_time:
+            self.end_time = t
+
+    def saw_prefix_fallback(self) -> None:
+        self.prefix_fallback_lines += 1
+
+    def merge(self, other: "_ParseState") -> None:
+        # Merging the states of consecutive chunks in order gives exactly the
+        # same result as parsing all of the lines in one go.
+        for pid, stmts in other.stmts_by_process.items():
+            self.stmts_by_process.setdefault(pid, []).extend(stmts)
+
+        self.events.extend(other.events)
+
+        for pid, t in other.pids_by_first_seen.items():
+            self.saw_pid_at(pid, t)
+
+        if other.start_time is not None:
+            self.saw_timestamp(other.start_time)
+        if other.end_time is not None:
+            self.saw_timestamp(other.end_time)
+
+        self.parsed_lines += other.parsed_lines
+        self.prefix_fallback_lines += other.prefix_fallback_lines
+
+    def _stats(self, inferred_log_line_prefix: Optional[str]) -> ParseStats:
+        return ParseStats(
+            parsed_lines=self.parsed_lines,
+            prefix_fallback_lines=self.prefix_fallback_lines,
+            inferred_log_line_prefix=inferred_log_line_prefix,
+        )
+
+    def to_columnar(
+        self, inferred_log_line_prefix: Optional[str] = None
+    ) -> ColumnarModel:
+        # Consumes the state: records are dropped as they are converted, so that
+        # they don't all have to be held next to their columnar copy.
+        if self.start_time is None or self.end_time is None:
+            raise RuntimeError("No recognized log lines found in input")
+
+        rv = ColumnarModel(
+            self.start_time, self.end_time, self._stats(inferred_log_line_prefix)
+        )
+
+        for pid, first_appearance in self.pids_by_first_seen.items():
+            rv.add_process(pid, first_appearance)
+
+        for stmts in self.stmts_by_process.values():
+            for stmt in stmts:
+                rv.add_statement(
+                    stmt.start_time, stmt.end_time, stmt.context, stmt.statement
+                )
+            stmts.clear()
+
+        for evt in self.events:
+            rv.add_event(
+                evt.time,
+                evt.context,
+                evt.event_type,
+                evt.description,
+                evt.primary_related_pids,
+                evt.secondary_related_pids,
+            )
+        self.events.clear()
+
+        return rv
+
+    def to_model(self, inferred_log_line_prefix: Optional[str] = None) -> Model:
+        if self.start_time is None or self.end_time is None:
+            raise RuntimeError("No recognized log lines found in input")
+
+        processes = []
+        for pid in self.pids_by_first_seen:
+            processes.append(
+                Process(
+                    pid=pid,
+                    first_appearance=self.pids_by_first_seen[pid],
+                )
+            )
+
+        return Model(
+            statements=[
+                _statement_from_record(stmt)
+                for stmts in self.stmts_by_process.values()
+                for stmt in stmts
+            ],
+            events=[_event_from_record(evt) for evt in self.events],
+            processes=processes,
+            start_time=self.start_time,
+            end_time=self.end_time,
+            stats=self._stats(inferred_log_line_prefix),
+        )
+
+
+def _parse_postgres_chunk(
+    lines: Iterable[_AnyLogLine],
+    options: ParseOptions,
+    first_line_no: int = 1,
+    inferred_prefix_format: Optional[str] = None,
+) -> _ParseState:
+    default_matchers = [
+        _make_prefix_record_parser(f) for f in DEFAULT_LOG_PREFIX_FORMATS
+    ]
 
     prefix_matchers = []
+    if inferred_prefix_format:
+        # The built-in matchers stay around as a fallback for lines that the
+        # inferred format doesn't cover.
+        prefix_matchers.append(_make_prefix_record_parser(inferred_prefix_format))
+        prefix_matchers.extend(default_matchers)
+
     if options.log_line_prefix_format:
-        prefix_matchers.append(make_prefix_parser(options.log_line_prefix_format))
+        prefix_matchers.append(
+            _make_prefix_record_parser(options.log_line_prefix_format)
+        )
 
     if options.log_line_prefix_regex:
         # The regex will be long and ugly.
         # It's available as a fallback for people who use options not supported by the
         # format-string parser.
         prefix_matchers.append(
-            _make_prefix_parser_from_regex(options.log_line_prefix_regex)
+            _make_prefix_record_parser_from_regex(options.log_line_prefix_regex)
         )
 
-    stmts_by_process = collections.defaultdict(list)
-    events = []
-
-    pids_by_first_seen: dict[int, datetime.datetime] = {}
-
-    def saw_pid_at(pid: int, t: datetime.datetime):
-        try:
-            old_time = pids_by_first_seen[pid]
-        except KeyError:
-            pids_by_first_seen[pid] = t
-        else:
-            if old_time > t:
-                pids_by_first_seen[pid] = t
+    state = _ParseState()
+    parse_prefix = make_adaptive_prefix_parser(
+        prefix_matchers or default_matchers, state.saw_prefix_fallback
+    )
+    stmts_by_process = state.stmts_by_process
+    events = state.events
+    saw_pid_at = state.saw_pid_at
 
     def handle_duration(context, core):
-        parsed = parse_duration_log_line(core)
-        if not parsed:
-            raise RuntimeError(f"Unable to parse duration log line: {core}")
+        duration_usec, statement = _parse_duration(core)
 
-        stmt = create_statement(context, parsed)
+        stmt = _create_statement_record(context, duration_usec, statement)
         assert stmt.pid
 
         saw_pid_at(stmt.pid, stmt.start_time)
 
-        stmts_by_process[stmt.pid].append(stmt)
+        stmts_by_process.setdefault(stmt.pid, []).append(stmt)
 
     def handle_automatic_analyze(context, core):
         events.append(
-            Event(
+            _EventRecord(
                 time=context.timestamp,
                 pid=context.pid,
                 context=context,
@@ -850,7 +2481,7 @@ def parse_postgres_lines(
 
     def handle_automatic_vacuum(context, core):
         events.append(
-            Event(
+            _EventRecord(
                 time=context.timestamp,
                 pid=context.pid,
                 context=context,
@@ -861,7 +2492,7 @@ def parse_postgres_lines(
 
     def handle_disconnection(context, core):
         events.append(
-            Event(
+            _EventRecord(
                 time=context.timestamp,
                 pid=context.pid,
                 context=context,
@@ -871,7 +2502,7 @@ def parse_postgres_lines(
 
     def handle_connection_authorized(context, core):
         events.append(
-            Event(
+            _EventRecord(
                 time=context.timestamp,
                 pid=context.pid,
                 context=context,
@@ -880,30 +2511,28 @@ def parse_postgres_lines(
         )
 
     def handle_process_holding_lock(context, core):
-        entry = parse_holding_lock_log_line(core)
+        holding_lock_pid, wait_queue_pid = _parse_holding_lock(core)
 
-        saw_pid_at(entry.holding_lock_pid, context.timestamp)
-        for pid in entry.wait_queue_pid:
+        saw_pid_at(holding_lock_pid, context.timestamp)
+        for pid in wait_queue_pid:
             saw_pid_at(pid, context.timestamp)
 
-        wait_queue_except_self = tuple(
-            x for x in entry.wait_queue_pid if x != context.pid
-        )
+        wait_queue_except_self = tuple(x for x in wait_queue_pid if x != context.pid)
 
         events.append(
-            Event(
+            _EventRecord(
                 time=context.timestamp,
                 pid=context.pid,
                 context=context,
                 event_type=EventType.WAITING_FOR_LOCK,
-                primary_related_pids=(entry.holding_lock_pid,),
+                primary_related_pids=(holding_lock_pid,),
                 secondary_related_pids=wait_queue_except_self,
             )
         )
 
     def handle_deadlock_detected(context, core):
         events.append(
-            Event(
+            _EventRecord(
                 time=context.timestamp,
                 pid=context.pid,
                 context=context,
@@ -921,93 +2550,531 @@ def parse_postgres_lines(
         "LOG:  automatic vacuum of ": handle_automatic_vacuum,
     }
 
-    timestamp_minmax: list[datetime.datetime] = []
+    assert dispatch.keys() == set(DISPATCH_KEYS)
+    match_dispatch_key = make_dispatch_matcher(DISPATCH_KEYS)
 
-    def try_parse(line: LogLine):
-        for key, func in dispatch.items():
-            if key in line.line:
-                prefix, _, core = line.line.partition(key)
+    def try_parse(line: _AnyLogLine):
+        matched = match_dispatch_key(line.line)
+        if not matched:
+            return
 
-                context = parse_log_prefix(prefix, prefix_matchers)
-                if line.timestamp:
-                    context.timestamp = line.timestamp
+        prefix, key, core = matched
 
-                if not timestamp_minmax:
-                    timestamp_minmax.append(context.timestamp)
-                    timestamp_minmax.append(context.timestamp)
-                else:
-                    timestamp_minmax[0] = min(timestamp_minmax[0], context.timestamp)
-                    timestamp_minmax[1] = max(timestamp_minmax[1], context.timestamp)
+        context = parse_prefix(prefix)
+        state.parsed_lines += 1
+        if line.timestamp:
+            context = context._replace(timestamp=line.timestamp)
 
-                saw_pid_at(context.pid, context.timestamp)
+        state.saw_timestamp(context.timestamp)
 
-                func(context, core)
-                break
+        saw_pid_at(context.pid, context.timestamp)
+
+        dispatch[key](context, core)
 
-    for i, line in enumerate(lines):
+    for i, line in enumerate(lines, first_line_no):
         try:
             try_parse(line)
         except Exception as e:
-            raise RuntimeError(
-                f"Failed to parse log line #{i+1}: {repr(line.line)}"
-            ) from e
+            # Entries that were skipped before parsing aren't counted in i
+            line_no = getattr(line, "line_no", None)
+            where = f"line #{i}" if line_no is None else f"line {line_no}"
+            raise RuntimeError(f"Failed to parse log {where}: {repr(line.line)}") from e
 
-    processes = []
-    for pid in pids_by_first_seen:
-        processes.append(
-            Process(
-                pid=pid,
-                first_appearance=pids_by_first_seen[pid],
+    return state
+
+
+PARALLEL_CHUNK_LINES = 20000
+
+
+def _chunk_lines(
+    lines: Iterable[_AnyLogLine], size: int
+) -> Iterator[list[_AnyLogLine]]:
+    # Chunks are only ever cut before a line that doesn't start with a tab, so
+    # that unmerged continuation lines stay with the line they continue.
+    chunk: list[_AnyLogLine] = []
+
+    for line in lines:
+        if len(chunk) >= size and not line.line.startswith("\t"):
+            yield chunk
+            chunk = []
+        chunk.append(line)
+
+    if chunk:
+        yield chunk
+
+
+def _parse_postgres_lines_parallel(
+    lines: Iterable[_AnyLogLine],
+    options: ParseOptions,
+    inferred_prefix_format: Optional[str] = None,
+) -> _ParseState:
+    import concurrent.futures
+
+    state = _ParseState()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        # Bound the number of chunks in flight so that streamed input is not
+        # read into memory faster than it can be parsed.
+        pending: collections.deque[concurrent.futures.Future] = collections.deque()
+        line_no = 1
+
+        for chunk in _chunk_lines(lines, PARALLEL_CHUNK_LINES):
+            pending.append(
+                executor.submit(
+                    _parse_postgres_chunk,
+                    chunk,
+                    options,
+                    line_no,
+                    inferred_prefix_format,
+                )
             )
-        )
+            line_no += len(chunk)
+
+            if len(pending) >= 2 * options.jobs:
+                state.merge(pending.popleft().result())
+
+        while pending:
+            state.merge(pending.popleft().result())
+
+    return state
+
+
+def _parse_postgres_state(
+    lines: Iterable[_AnyLogLine], options: Optional[ParseOptions] = None
+) -> tuple[_ParseState, Optional[str]]:
+    options = options or ParseOptions()
+
+    inferred_prefix_format = None
+    if options.infer_log_line_prefix and not (
+        options.log_line_prefix_format or options.log_line_prefix_regex
+    ):
+        # Infer once up front, so that every line (and every worker) can go
+        # straight to a single compiled matcher.
+        lines = iter(lines)
+        sample = list(itertools.islice(lines, PREFIX_INFERENCE_SAMPLE_LINES))
+        inferred_prefix_format = infer_log_line_prefix(line.line for line in sample)
+        lines = itertools.chain(sample, lines)
+
+    if options.jobs > 1:
+        state = _parse_postgres_lines_parallel(lines, options, inferred_prefix_format)
+    else:
+        state = _parse_postgres_chunk(lines, options, 1, inferred_prefix_format)
+
+    return state, inferred_prefix_format
+
+
+def parse_postgres_lines(
+    lines: Iterable[_AnyLogLine], options: Optional[ParseOptions] = None
+) -> Model:
+    state, inferred_prefix_format = _parse_postgres_state(lines, options)
+    return state.to_model(inferred_prefix_format)
+
+
+def parse_postgres_lines_columnar(
+    lines: Iterable[_AnyLogLine], options: Optional[ParseOptions] = None
+) -> ColumnarModel:
+    state, inferred_prefix_format = _parse_postgres_state(lines, options)
+    return state.to_columnar(inferred_prefix_format)
 
-    return Model(
-        statements=[stmt for stmts in stmts_by_process.values() for stmt in stmts],
-        events=events,
-        processes=processes,
-        start_time=timestamp_minmax[0],
-        end_time=timestamp_minmax[1],
-    )
 
+def _merge_continuation_records(
+    lines: Iterable[_LineRecord],
+) -> Iterator[_LineRecord]:
+    # Only the entry currently being assembled is held in memory; continuation
+    # parts are collected and joined once to avoid quadratic string building.
+    last_line: Optional[_LineRecord] = None
+    continuations: list[str] = []
 
-def merge_continuation_lines(lines: Iterator[LogLine]) -> Iterator[LogLine]:
-    last_line: Optional[LogLine] = None
+    def flush() -> _LineRecord:
+        assert last_line is not None
+        if not continuations:
+            return last_line
+
+        merged = last_line._replace(line="\n".join([last_line.line, *continuations]))
+        continuations.clear()
+        return merged
 
     for line in lines:
         if not line.line.startswith("\t"):
             if last_line:
-                yield last_line
-            last_line = line.copy()
+                yield flush()
+            last_line = line
             continue
 
         if last_line is None:
             raise RuntimeError("Continuation line without preceding line")
 
-        last_line.line += "\n" + line.line
+        continuations.append(line.line)
 
     if last_line:
-        yield last_line
+        yield flush()
+
+
+def merge_continuation_lines(lines: Iterable[LogLine]) -> Iterator[LogLine]:
+    records = (_LineRecord(line.timestamp, line.line) for line in lines)
+
+    for record in _merge_continuation_records(records):
+        yield _line_from_record(record)
+
+
+def _iter_lines_with_header(header: str, f: typing.TextIO) -> Iterator[str]:
+    # Re-attach the sniffed header to the rest of the stream, completing the
+    # last header line if it was cut off mid-line.
+    pending = ""
+
+    for line in io.StringIO(header):
+        if not line.endswith("\n"):
+            pending = line
+            break
+        yield line
+
+    for line in f:
+        if pending:
+            line = pending + line
+            pending = ""
+        yield line
+
+    if pending:
+        yield pending
+
 
+def _read_plain_lines(header: str, f: typing.TextIO) -> Iterator[_LineRecord]:
+    # Plain text is streamed line by line, so memory use is bounded by the
+    # longest log entry rather than by the size of the input.
+    yield from _iter_simple_records(_iter_lines_with_header(header, f))
 
-def _parse_unmerged_log_lines(f: typing.TextIO) -> Iterator[LogLine]:
-    data = f.read()
+
+def _read_google_json(header: str, f: typing.TextIO) -> Iterator[_LineRecord]:
+    yield from _ingest_google_json_records(iter_json_array(header, f))
+
+
+def _read_json_lines(header: str, f: typing.TextIO) -> Iterator[_LineRecord]:
+    records = (
+        json.loads(line) for line in _iter_lines_with_header(header, f) if line.strip()
+    )
+    yield from _ingest_google_json_records(records)
+
+
+CARRIER_READERS: dict[
+    CarrierFormat, Callable[[str, typing.TextIO], Iterator[_LineRecord]]
+] = {
+    CarrierFormat.PLAIN: _read_plain_lines,
+    CarrierFormat.GOOGLE_JSON: _read_google_json,
+    CarrierFormat.JSON_LINES: _read_json_lines,
+}
+
+
+class Compression(str, enum.Enum):
+    GZIP = "gzip"
+    BZIP2 = "bzip2"
+    XZ = "xz"
+    ZSTD = "zstd"
+
+
+COMPRESSION_MAGIC = {
+    Compression.GZIP: b"\x1f\x8b",
+    Compression.BZIP2: b"BZh",
+    Compression.XZ: b"\xfd7zXZ\x00",
+    Compression.ZSTD: b"\x28\xb5\x2f\xfd",
+}
+
+
+def detect_compression(f: typing.TextIO) -> Optional[Compression]:
+    # Peeks at the start of the underlying binary stream, without consuming
+    # anything, so it has to be called before the text stream is read from
+    buffer = getattr(f, "buffer", None)
+    if buffer is None or not hasattr(buffer, "peek"):
+        return None
 
     try:
-        json_record = json.loads(data)
-        yield from ingest_logs_google_json(json_record)
-    except json.decoder.JSONDecodeError:
-        yield from split_simple_lines(data)
+        magic = buffer.peek(max(map(len, COMPRESSION_MAGIC.values())))
+    except (OSError, ValueError):
+        return None
+
+    for compression, prefix in COMPRESSION_MAGIC.items():
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+
+def _open_decompressor(
+    compression: Compression, stream: typing.BinaryIO
+) -> io.BufferedIOBase:
+    if compression == Compression.GZIP:
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if compression == Compression.BZIP2:
+        import bz2
+
+        return bz2.BZ2File(stream)
+    if compression == Compression.XZ:
+        import lzma
+
+        return lzma.LZMAFile(stream)
+
+    try:
+        import zstandard  # type: ignore
+    except ImportError:
+        raise RuntimeError(
+            "Reading zstd-compressed logs needs the zstandard package"
+        ) from None
+    return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+
+
+PREFETCH_CHUNK_SIZE = 1 << 20
+PREFETCH_CHUNKS = 4
+
+
+class _PrefetchReader(io.RawIOBase):
+    """
+    Reads a binary stream ahead in a background thread. The decompressors
+    release the GIL while they work, so this lets decompression of the next
+    chunks overlap with parsing of the current one.
+    """
+
+    def __init__(self, stream: io.BufferedIOBase) -> None:
+        self._chunks: queue.Queue = queue.Queue(maxsize=PREFETCH_CHUNKS)
+        self._pending = memoryview(b"")
+        self._eof = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._fill, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def _fill(self, stream: io.BufferedIOBase) -> None:
+        try:
+            while not self._stopped.is_set():
+                chunk = stream.read(PREFETCH_CHUNK_SIZE)
+                self._chunks.put(chunk)
+                if not chunk:
+                    break
+        except BaseException as e:
+            self._chunks.put(e)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._pending and not self._eof:
+            item = self._chunks.get()
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            self._eof = not item
+            self._pending = memoryview(item)
+
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self) -> None:
+        # Unblock the reading thread if it's waiting for room in the queue
+        self._stopped.set()
+        while self._thread.is_alive():
+            try:
+                self._chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        super().close()
+
+
+def open_decompressed(f: typing.TextIO) -> typing.TextIO:
+    """
+    Returns f if it isn't compressed, or else a text stream of its
+    decompressed contents, in the same encoding. The compression is detected
+    from the first few bytes, so f must not have been read from yet.
+    """
+    compression = detect_compression(f)
+    if compression is None:
+        return f
+
+    return io.TextIOWrapper(
+        io.BufferedReader(_PrefetchReader(_open_decompressor(compression, f.buffer))),
+        encoding=f.encoding,
+        errors=f.errors,
+    )
+
+
+def _parse_unmerged_log_lines(f: typing.TextIO) -> Iterator[_LineRecord]:
+    f = open_decompressed(f)
+    header = f.read(CARRIER_SNIFF_SIZE)
+    reader = CARRIER_READERS[sniff_carrier_format(header)]
+    yield from reader(header, f)
+
+
+def _parse_log_records_automagically(f: typing.TextIO) -> Iterator[_LineRecord]:
+    yield from _merge_continuation_records(_parse_unmerged_log_lines(f))
+
+
+def _map_plain_text_file(f: typing.TextIO) -> Optional[mmap.mmap]:
+    # Only plain-text regular files that haven't been read from yet, in an
+    # encoding in which the dispatch keys can be searched for as ASCII
+    try:
+        if not stat.S_ISREG(os.fstat(f.fileno()).st_mode) or f.tell() != 0:
+            return None
+    except (OSError, ValueError):
+        return None
+
+    if "\n\t:  ".encode(f.encoding) != b"\n\t:  ":
+        return None
+
+    try:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # e.g. an empty file, which can't be mapped
+        return None
+
+    header = mapped[:CARRIER_SNIFF_SIZE].decode(f.encoding, "ignore")
+    if sniff_carrier_format(header) != CarrierFormat.PLAIN:
+        return None
+
+    return mapped
+
+
+def _is_record_start(line: bytes) -> bool:
+    # Blank lines are dropped, and lines starting with a tab continue the
+    # previous entry, just as when reading line by line
+    return not line.startswith(b"\t") and bool(line.strip())
+
+
+def _iter_mapped_records(
+    mapped: mmap.mmap, encoding: str, errors: Optional[str]
+) -> Iterator[_LineRecord]:
+    # Searches the mapped file for dispatch keys, and only decodes the entries
+    # they're found in. The result is the same as merging continuation lines
+    # of all lines and leaving out entries that no key matches. The file is
+    # unmapped when done, or when the caller stops early and closes this.
+    with mapped:
+        search = re.compile(_make_dispatch_regex(DISPATCH_KEYS)[0].encode()).search
+        size = len(mapped)
+
+        def line_at(start: int) -> bytes:
+            end = mapped.find(b"\n", start)
+            return mapped[start : end if end >= 0 else size]
+
+        pos = 0
+        line_no, counted_to = 1, 0
+        while True:
+            m = search(mapped, pos)
+            if not m:
+                break
+
+            start = mapped.rfind(b"\n", 0, m.start()) + 1
+            while not _is_record_start(line_at(start)):
+                if start == 0:
+                    raise RuntimeError("Continuation line without preceding line")
+                start = mapped.rfind(b"\n", 0, start - 1) + 1
+
+            end = mapped.find(b"\n", m.end())
+            while 0 <= end < size - 1 and not _is_record_start(line_at(end + 1)):
+                end = mapped.find(b"\n", end + 1)
+            end = end + 1 if end >= 0 else size
+
+            line_no += mapped[counted_to:start].count(b"\n")
+            counted_to = start
+
+            text = mapped[start:end].decode(encoding, errors or "strict")
+            yield _LineRecord(
+                None,
+                "\n".join(
+                    line.rstrip("\r") for line in text.split("\n") if line.strip()
+                ),
+                line_no,
+            )
+            pos = end
+
+
+def _parse_dispatchable_records(
+    f: typing.TextIO,
+) -> typing.Generator[_LineRecord, None, None]:
+    # Entries for the parser, which may leave out entries no dispatch key
+    # matches; uncompressed plain-text files are memory-mapped to skip those
+    # cheaply.
+    mapped = None if detect_compression(f) else _map_plain_text_file(f)
+    if mapped is None:
+        yield from _parse_log_records_automagically(f)
+    else:
+        yield from _iter_mapped_records(mapped, f.encoding, f.errors)
 
 
 def parse_log_lines_automagically(f: typing.TextIO) -> Iterator[LogLine]:
-    yield from merge_continuation_lines(_parse_unmerged_log_lines(f))
+    for record in _parse_log_records_automagically(f):
+        yield _line_from_record(record)
 
 
 def parse_log_data_automagically(
     f: typing.TextIO, options: Optional[ParseOptions] = None
 ) -> Model:
-    lines = parse_log_lines_automagically(f)
-    return parse_postgres_lines(list(lines), options)
+    with contextlib.closing(_parse_dispatchable_records(f)) as lines:
+        return parse_postgres_lines(lines, options)
+
+
+def parse_log_data_columnar(
+    f: typing.TextIO, options: Optional[ParseOptions] = None
+) -> ColumnarModel:
+    with contextlib.closing(_parse_dispatchable_records(f)) as lines:
+        return parse_postgres_lines_columnar(lines, options)
+
+
+# Bump when ColumnarModel changes in a way that makes older dumps unusable
+MODEL_CACHE_FORMAT = 3
+
+
+def _model_cache_key(f: typing.TextIO, path: str, options: ParseOptions) -> str:
+    digest = hashlib.sha256()
+    digest.update(f"{__version__} {MODEL_CACHE_FORMAT}\n".encode())
+    # The same bytes decode to different text in another encoding
+    digest.update(
+        f"{getattr(f, 'encoding', None)} {getattr(f, 'errors', None)}\n".encode()
+    )
+    # The number of jobs doesn't change the result
+    digest.update(options.json(exclude={"jobs"}).encode())
+    with open(path, "rb") as raw:
+        for block in iter(functools.partial(raw.read, 1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_log_file_cached(
+    f: typing.TextIO, cache_dir: str, options: Optional[ParseOptions] = None
+) -> ColumnarModel:
+    """
+    Like parse_log_data_columnar(), but keeps the parsed model in cache_dir,
+    keyed by the contents of the file and the parse options, so that a file
+    only has to be parsed once. Input that isn't a regular file, like stdin, is
+    parsed without caching.
+    """
+    options = options or ParseOptions()
+
+    name = getattr(f, "name", None)
+    if not isinstance(name, str) or not os.path.isfile(name):
+        return parse_log_data_columnar(f, options)
+
+    path = os.path.join(cache_dir, _model_cache_key(f, name, options) + ".model")
+    try:
+        with open(path, "rb") as cached:
+            return ColumnarModel.load(cached)
+    except Exception:
+        # Whatever is wrong with an entry, or if there is none, parsing again
+        # replaces it
+        pass
+
+    model = parse_log_data_columnar(f, options)
+
+    # Written to a temporary file first so that concurrent runs never see a
+    # partial model
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as out:
+            model.dump(out)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return model
 
 
 def run_analyzer(
@@ -1016,6 +3083,10 @@ def run_analyzer(
     output_file: typing.TextIO,
     parse_options: Optional[ParseOptions] = None,
     viz_options: Optional[VizOptions] = None,
+    cache_dir: Optional[str] = None,
 ) -> None:
-    model = parse_log_data_automagically(input_file, parse_options)
+    if cache_dir:
+        model = parse_log_file_cached(input_file, cache_dir, parse_options)
+    else:
+        model = parse_log_data_columnar(input_file, parse_options)
     visualize(model, output_file, viz_options)
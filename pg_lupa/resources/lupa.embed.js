@@ -1,16 +1,80 @@
-const unfocusedContent = $("#context-info").html();
+const contextInfo = document.getElementById("context-info");
+const unfocusedContent = contextInfo.innerHTML;
 let contentLockedToID = null;
 
-function unfocus() {
-  $("#context-info").html(unfocusedContent);
-  $(".context-highlight").removeClass("context-highlight");
-  $(".process-highlight").removeClass(
-    "process-primary-highlight process-secondary-highlight"
+const SVG_NS = "http://www.w3.org/2000/svg";
+
+// Creates an HTML element with the given properties and children
+function htmlElement(tag, props, children) {
+  const node = Object.assign(document.createElement(tag), props);
+  node.append(...(children || []));
+  return node;
+}
+
+// Creates an SVG element with the given attributes
+function svgElement(tag, attrs) {
+  const node = document.createElementNS(SVG_NS, tag);
+  Object.entries(attrs || {}).forEach(([name, value]) =>
+    node.setAttribute(name, value)
   );
+  return node;
+}
+
+// Shows which element is in focus, and which processes are related to it
+const svgHighlighter = {
+  current: null,
+  clear: function () {
+    this.current = null;
+    document
+      .querySelectorAll(".context-highlight")
+      .forEach((node) => node.classList.remove("context-highlight"));
+    document
+      .querySelectorAll(".process-highlight")
+      .forEach((node) =>
+        node.classList.remove(
+          "process-highlight",
+          "process-primary-highlight",
+          "process-secondary-highlight"
+        )
+      );
+  },
+  highlight: function (id, processes1, processes2) {
+    this.clear();
+    this.current = [id, processes1, processes2];
+
+    const addClass = (id, ...classes) => {
+      const node = document.getElementById(id);
+      if (node) node.classList.add(...classes);
+    };
+
+    addClass(id, "context-highlight");
+
+    if (processes1) {
+      processes1.forEach((procid) => {
+        addClass(procid, "process-highlight", "process-primary-highlight");
+      });
+    }
+    if (processes2) {
+      processes2.forEach((procid) => {
+        addClass(procid, "process-highlight", "process-secondary-highlight");
+      });
+    }
+  },
+  // Applies the highlight to elements added since it was set
+  refresh: function () {
+    if (this.current) this.highlight(...this.current);
+  },
+};
+
+let highlighter = svgHighlighter;
+
+function unfocus() {
+  contextInfo.innerHTML = unfocusedContent;
+  highlighter.clear();
   contentLockedToID = null;
 }
 
-function setSidebarContent(id, content, lock, processes1, processes2) {
+function setSidebarContent(id, makeContent, lock, processes1, processes2) {
   if (contentLockedToID && !lock) return;
 
   const alreadyLockedToThis = contentLockedToID && contentLockedToID === id;
@@ -20,195 +84,1150 @@ function setSidebarContent(id, content, lock, processes1, processes2) {
     return;
   }
 
-  $("#context-info").html(content);
+  contextInfo.replaceChildren(...makeContent());
   contentLockedToID = lock && id ? id : null;
 
-  $(".context-highlight").removeClass("context-highlight");
+  highlighter.highlight(id, processes1, processes2);
+}
+
+function resetSidebarContent(force) {
+  setSidebarContent(null, null, force);
+}
+
+// Same output as format_duration() in lupa.py
+function formatDuration(usec) {
+  let remaining = usec / 1e6;
+
+  const days = Math.floor(remaining / 86400);
+  remaining -= days * 86400;
 
-  if (id) {
-    $("#" + id).addClass("context-highlight");
+  const hours = Math.floor(remaining / 3600);
+  remaining -= hours * 3600;
+
+  const minutes = Math.floor(remaining / 60);
+  remaining -= minutes * 60;
+
+  const seconds = remaining;
+
+  let comp = "";
+
+  if (days) comp += days + "d";
+  if (hours) comp += hours + "h";
+  if (minutes) comp += minutes + "m";
+  if (seconds) {
+    if (Number.isInteger(seconds)) {
+      comp += seconds + "s";
+    } else {
+      comp += seconds.toFixed(3) + "s";
+    }
   }
 
-  $(".process-highlight").removeClass(
-    "process-primary-highlight process-secondary-highlight"
-  );
-  if (processes1) {
-    processes1.forEach((procid) => {
-      $(document.getElementById(procid)).addClass(
-        "process-highlight process-primary-highlight"
-      );
-    });
+  return comp + " (" + Math.trunc(usec / 1000) + "ms)";
+}
+
+// Formats microseconds since the epoch like "%Y-%m-%d %H:%M:%S.%f %Z"
+function makeTimeFormatter(data) {
+  const pad = (x, n) => x.toString().padStart(n, "0");
+
+  return function (usec) {
+    let i = data.utc_offsets.length - 1;
+    while (i > 0 && data.utc_offsets[i].start_time_unix_usec > usec) i--;
+    const offset = data.utc_offsets[i];
+
+    const fraction = ((usec % 1e6) + 1e6) % 1e6;
+    const seconds = (usec - fraction) / 1e6;
+    const t = new Date((seconds + offset.offset_seconds) * 1000);
+
+    return (
+      [
+        pad(t.getUTCFullYear(), 4),
+        pad(t.getUTCMonth() + 1, 2),
+        pad(t.getUTCDate(), 2),
+      ].join("-") +
+      " " +
+      [
+        pad(t.getUTCHours(), 2),
+        pad(t.getUTCMinutes(), 2),
+        pad(t.getUTCSeconds(), 2),
+      ].join(":") +
+      "." +
+      pad(fraction, 6) +
+      " " +
+      offset.name
+    );
+  };
+}
+
+// Builds the same markup as context.template.html
+function renderDataTable(rows, text) {
+  const content = [];
+
+  if (rows.length) {
+    const table = htmlElement(
+      "table",
+      { className: "context" },
+      rows.map(([label, value]) =>
+        htmlElement("tr", { className: "context" }, [
+          htmlElement("td", { className: "context-label", textContent: label }),
+          htmlElement("td", { className: "context-value", textContent: value }),
+        ])
+      )
+    );
+    content.push(table);
   }
-  if (processes2) {
-    processes2.forEach((procid) => {
-      $(document.getElementById(procid)).addClass(
-        "process-highlight process-secondary-highlight"
-      );
+  if (rows.length && text) {
+    content.push(htmlElement("hr", { className: "context" }));
+  }
+  if (text) {
+    content.push(
+      htmlElement("p", {
+        className: "context-extended-text",
+        textContent: text,
+      })
+    );
+  }
+
+  return content;
+}
+
+// Same rows as make_data_table() in lupa.py
+function contextRows(data, d) {
+  const context = data.contexts[d.context];
+  const rows = [];
+
+  if (context.pid) rows.push(["PID", "" + context.pid]);
+  if (d.log_line_no) rows.push(["Log line no.", "" + d.log_line_no]);
+  if (context.username) rows.push(["Username", context.username]);
+  if (context.database) rows.push(["Database", context.database]);
+  if (context.application_name) {
+    rows.push(["Application", context.application_name]);
+  }
+
+  return rows;
+}
+
+function makeSidebarContentBuilders(data) {
+  const formatTime = makeTimeFormatter(data);
+  const offsetUsec = (seconds) =>
+    data.start_time_unix_usec + Math.round(seconds * 1e6);
+
+  return {
+    statement: function (d) {
+      return function () {
+        const start = offsetUsec(d.t_offset);
+        const end = start + Math.round(d.duration * 1e6);
+        return renderDataTable(
+          contextRows(data, d).concat([
+            ["Start", formatTime(start)],
+            ["End", formatTime(end)],
+            ["Duration", formatDuration(end - start)],
+          ]),
+          data.texts[d.text]
+        );
+      };
+    },
+    event: function (d) {
+      return function () {
+        return renderDataTable(
+          contextRows(data, d).concat([
+            ["Time", formatTime(offsetUsec(d.t_offset))],
+            ["Event", d.event_type],
+          ]),
+          d.text === null ? null : data.texts[d.text]
+        );
+      };
+    },
+    // Shows the kind of statement that took up most of the bucket's time
+    bucket: function (level, i) {
+      return function () {
+        const start =
+          data.start_time_unix_usec + level.bucket[i] * level.bucket_usec;
+        const process = level.process[i];
+        return renderDataTable(
+          [
+            process === null
+              ? ["PIDs", "several"]
+              : ["PID", "" + data.processes[process].pid],
+            ["From", formatTime(start)],
+            ["To", formatTime(start + level.bucket_usec)],
+            ["Statements", "" + level.count[i]],
+            ["Longest", formatDuration(level.max_duration_usec[i])],
+          ],
+          data.texts[level.text[i]]
+        );
+      };
+    },
+  };
+}
+
+function unzipColumns(columns) {
+  const names = Object.keys(columns);
+  const length = names.length ? columns[names[0]].length : 0;
+  const rows = new Array(length);
+
+  for (let i = 0; i < length; i++) {
+    const row = {};
+    names.forEach((name) => {
+      row[name] = columns[name][i];
     });
+    rows[i] = row;
   }
+
+  return rows;
 }
 
-function resetSidebarContent(force) {
-  setSidebarContent(null, "", force);
+// Expands the payload written by make_compact_payload() in lupa.py into the
+// same shape as the full VizData JSON
+function decodeCompactData(raw) {
+  const processIds = raw.processes.pid.map((pid) => "process_" + pid);
+  const toProcessIds = (indices) => indices.map((i) => processIds[i]);
+
+  return Object.assign({}, raw, {
+    processes: unzipColumns(raw.processes).map((d, i) => ({
+      id: processIds[i],
+      y: d.y,
+      height: d.height,
+      pid: d.pid,
+      t_offset: d.t_offset_usec === null ? null : d.t_offset_usec / 1e6,
+      duration: d.duration_usec === null ? null : d.duration_usec / 1e6,
+    })),
+    contexts: unzipColumns(raw.contexts),
+    statements: unzipColumns(raw.statements).map((d, i) => ({
+      id: "stmt" + (i + 1),
+      t_offset: d.t_offset_usec / 1e6,
+      y: d.y,
+      height: d.height,
+      duration: d.duration_usec / 1e6,
+      colour: raw.colours[d.colour],
+      process_element_id: processIds[d.process],
+      context: d.context,
+      log_line_no: d.log_line_no,
+      text: d.text,
+    })),
+    events: unzipColumns(raw.events).map((d, i) => ({
+      id: "event_" + (i + 1),
+      t_offset: d.t_offset_usec / 1e6,
+      cy: d.cy,
+      size: d.size,
+      colour: raw.colours[d.colour],
+      primary_related_process_ids: toProcessIds(d.primary_related_processes),
+      secondary_related_process_ids: toProcessIds(
+        d.secondary_related_processes
+      ),
+      event_type: raw.event_types[d.event_type],
+      context: d.context,
+      log_line_no: d.log_line_no,
+      text: d.text,
+    })),
+    lod_levels: raw.lod_levels.map((level) =>
+      Object.assign({}, level, {
+        colour: level.colour.map((i) => raw.colours[i]),
+      })
+    ),
+  });
 }
 
-function draw() {
-  const rightSpacing = 20;
-  const topLegendSpace = 30;
-  const leftLegendSpace = 50;
-  const width = $("#timeline").width() - rightSpacing - leftLegendSpace;
-  const data = JSON.parse(document.getElementById("data").textContent);
-
-  const div = d3
-    .select("body")
-    .append("div")
-    .attr("class", "tooltip")
-    .style("opacity", 0);
-
-  const svg = d3
-    .select("#timeline")
-    .append("svg")
-    .attr("width", width + leftLegendSpace)
-    .attr("height", data.total_height);
-
-  const scale = d3
-    .scaleLinear()
-    .domain([data.start_time_unix_seconds, data.end_time_unix_seconds])
-    .range([leftLegendSpace, width + leftLegendSpace]);
-  const axis = d3
-    .axisBottom()
-    .scale(scale)
-    .tickFormat(function (x) {
-      const t = new Date(x * 1000);
-      const hs = t.getHours().toString().padStart(2, "0");
-      const ms = t.getMinutes().toString().padStart(2, "0");
-      const ss = t.getSeconds().toString().padStart(2, "0");
-      return hs + ":" + ms + ":" + ss;
+async function inflateBase64(s) {
+  const bytes = Uint8Array.from(atob(s.trim()), (c) => c.charCodeAt(0));
+  const stream = new Blob([bytes])
+    .stream()
+    .pipeThrough(new DecompressionStream("gzip"));
+  return await new Response(stream).text();
+}
+
+async function loadData() {
+  const element = document.getElementById("data");
+  let text = element.textContent;
+  if (element.dataset.encoding === "gzip+base64") {
+    text = await inflateBase64(text);
+  }
+
+  const raw = JSON.parse(text);
+  return raw.format === "compact" ? decodeCompactData(raw) : raw;
+}
+
+// Returns the first position in a sorted array whose value is >= x, or > x
+function bisect(array, x, after) {
+  let lo = 0;
+  let hi = array.length;
+  while (lo < hi) {
+    const mid = (lo + hi) >>> 1;
+    if (array[mid] < x || (after && array[mid] === x)) {
+      lo = mid + 1;
+    } else {
+      hi = mid;
+    }
+  }
+  return lo;
+}
+
+// Lanes are the distinct y positions of processes, top to bottom
+function makeLanes(processes) {
+  const lanes = Array.from(
+    new Map(processes.map((p) => [p.y, p.height])),
+    ([y, height]) => ({ y, height })
+  ).sort((a, b) => a.y - b.y);
+  const ys = lanes.map((lane) => lane.y);
+
+  return {
+    count: lanes.length,
+    height: (lane) => lanes[lane].height,
+    // Returns the lane at a y position, or -1 if there is none
+    at: (y) => {
+      const lane = bisect(ys, y, true) - 1;
+      return lane >= 0 && y < lanes[lane].y + lanes[lane].height ? lane : -1;
+    },
+    // Returns the range [first, last) of lanes overlapping [y0, y1]
+    between: (y0, y1) => [
+      Math.max(bisect(ys, y0, true) - 1, 0),
+      bisect(ys, y1, true),
+    ],
+    // Groups items by the lane they are drawn in
+    group: function (items, yOf) {
+      const perLane = Array.from({ length: lanes.length }, () => []);
+      items.forEach((d) => {
+        const lane = this.at(yOf(d));
+        if (lane >= 0) perLane[lane].push(d);
+      });
+      return perLane;
+    },
+  };
+}
+
+// Calls update() with the range of the timeline's content that is scrolled
+// into view, widened by a margin, and again whenever that range changes
+function watchViewport(margin, update) {
+  const timeline = document.getElementById("timeline");
+  const changed = () =>
+    update(
+      timeline.scrollTop - margin,
+      timeline.scrollTop + timeline.clientHeight + margin
+    );
+
+  let updateRequested = false;
+  const requestUpdate = () => {
+    if (updateRequested) return;
+    updateRequested = true;
+    window.requestAnimationFrame(() => {
+      updateRequested = false;
+      changed();
     });
-  svg.append("g").call(axis);
-
-  svg
-    .selectAll()
-    .data(data.processes)
-    .enter()
-    .append("rect")
-    .attr("id", function (d) {
-      return d.id;
-    })
-    .attr("x", 0)
-    .attr("width", width + leftLegendSpace)
-    .attr("y", function (d) {
-      return d.y + topLegendSpace;
-    })
-    .attr("height", function (d) {
-      return d.height;
-    })
-    .attr("class", "pg_process");
-
-  svg
-    .selectAll()
-    .data(data.processes)
-    .enter()
-    .append("text")
-    .attr("x", 0)
-    .attr("y", function (d) {
-      return d.y + topLegendSpace;
-    })
-    .attr("font-size", "10px")
-    .text(function (d) {
-      return "" + d.pid;
-    })
-    .on("click", function (evt, d) {
-      evt.stopPropagation();
+  };
+
+  timeline.addEventListener("scroll", requestUpdate);
+  window.addEventListener("resize", requestUpdate);
+  changed();
+}
+
+// Maps report time (unix seconds) linearly to x positions, with the parts of
+// d3.scaleLinear() that the timeline uses
+function makeScale(domain, range) {
+  let [d0, d1] = domain;
+  const [r0, r1] = range;
+
+  const scale = (value) => r0 + ((value - d0) / (d1 - d0)) * (r1 - r0);
+  scale.domain = function (extent) {
+    if (!extent) return [d0, d1];
+    [d0, d1] = extent;
+    return scale;
+  };
+  scale.range = () => [r0, r1];
+  // About count round values in the domain, 1, 2 or 5 times a power of ten
+  // apart
+  scale.ticks = function (count) {
+    const rough = (d1 - d0) / count;
+    const power = Math.pow(10, Math.floor(Math.log10(rough)));
+    const error = rough / power;
+    const step =
+      power *
+      (error >= Math.sqrt(50)
+        ? 10
+        : error >= Math.sqrt(10)
+        ? 5
+        : error >= Math.sqrt(2)
+        ? 2
+        : 1);
+    // Divide rather than multiply by steps below 1, which aren't exact
+    const tick = step < 1 ? (i) => i / Math.round(1 / step) : (i) => i * step;
+
+    const ticks = [];
+    for (let i = Math.ceil(d0 / step); tick(i) <= d1; i++) ticks.push(tick(i));
+    return ticks;
+  };
+  return scale;
+}
+
+// Returns a function that draws an axis for the scale into an SVG group, in
+// the same way as d3.axisBottom()
+function makeAxis(scale, tickFormat) {
+  return function (group) {
+    const [r0, r1] = scale.range();
+
+    group.setAttribute("font-size", 10);
+    group.setAttribute("font-family", "sans-serif");
+    group.setAttribute("text-anchor", "middle");
+    group.replaceChildren(
+      svgElement("path", {
+        class: "domain",
+        stroke: "currentColor",
+        fill: "none",
+        d: "M" + (r0 + 0.5) + ",6V0.5H" + (r1 + 0.5) + "V6",
+      }),
+      ...scale.ticks(10).map((value) => {
+        const tick = svgElement("g", {
+          class: "tick",
+          transform: "translate(" + (scale(value) + 0.5) + ",0)",
+        });
+        const label = svgElement("text", {
+          fill: "currentColor",
+          y: 9,
+          dy: "0.71em",
+        });
+        label.textContent = tickFormat(value);
+        tick.append(
+          svgElement("line", { stroke: "currentColor", y2: 6 }),
+          label
+        );
+        return tick;
+      })
+    );
+  };
+}
+
+// Returns a function that keeps an SVG group's children in step with a list
+// of items, creating elements for new items and removing those for items that
+// are no longer listed
+function makeKeyedLayer(parent, create) {
+  const group = svgElement("g");
+  parent.append(group);
+
+  let nodes = new Map();
+  return function (items) {
+    const next = new Map();
+    items.forEach((d) => {
+      let node = nodes.get(d.id);
+      if (!node) {
+        node = create(d);
+        group.append(node);
+      }
+      next.set(d.id, node);
+    });
+    nodes.forEach((node, id) => {
+      if (!next.has(id)) node.remove();
     });
+    nodes = next;
+  };
+}
 
-  svg
-    .selectAll()
-    .data(data.statements)
-    .enter()
-    .append("rect")
-    .attr("id", function (d) {
-      return d.id;
-    })
-    .attr("class", "pg_stmt")
-    .attr("x", function (d) {
-      return (
-        leftLegendSpace + (d.t_offset / data.total_duration_seconds) * width
-      );
-    })
-    .attr("y", function (d) {
-      return d.y + topLegendSpace;
-    })
-    .attr("width", function (d) {
-      return (d.duration / data.total_duration_seconds) * width;
-    })
-    .attr("height", function (d) {
-      return d.height;
-    })
-    .style("fill", function (d) {
-      return d.colour;
-    })
-    .on("click", function (evt, d) {
-      setSidebarContent(d.id, d.mouseover_content, true);
+function drawSvg(data, layout, sidebarContent) {
+  const { width, leftLegendSpace, topLegendSpace } = layout;
+
+  const svg = svgElement("svg", {
+    width: width + leftLegendSpace,
+    height: data.total_height,
+  });
+  document.getElementById("timeline").append(svg);
+
+  const axisGroup = svgElement("g");
+  svg.append(axisGroup);
+  layout.axis(axisGroup);
+
+  // Only lanes within about a screen of the viewport are in the DOM at a
+  // time, so that logs with many processes stay responsive.
+  const lanes = makeLanes(data.processes);
+  const processesByLane = lanes.group(data.processes, (d) => d.y);
+  const statementsByLane = lanes.group(data.statements, (d) => d.y);
+  const eventsByLane = lanes.group(data.events, (d) => d.cy);
+
+  const focusStatement = (d, lock) =>
+    setSidebarContent(d.id, sidebarContent.statement(d), lock);
+  const focusEvent = (d, lock) =>
+    setSidebarContent(
+      d.id,
+      sidebarContent.event(d),
+      lock,
+      d.primary_related_process_ids,
+      d.secondary_related_process_ids
+    );
+  const listen = (node, d, focus) => {
+    node.addEventListener("click", function (evt) {
+      focus(d, true);
       evt.stopPropagation();
-    })
-    .on("mouseover", function (evt, d) {
-      setSidebarContent(d.id, d.mouseover_content, false);
+    });
+    node.addEventListener("mouseover", function (evt) {
+      focus(d, false);
       evt.stopPropagation();
-    })
-    .on("mouseout", function (d) {
+    });
+    node.addEventListener("mouseout", function () {
       resetSidebarContent(false);
     });
+    return node;
+  };
 
-  svg
-    .selectAll()
-    .data(data.events)
-    .enter()
-    .append("circle")
-    .attr("id", function (d) {
-      return d.id;
-    })
-    .attr("cx", function (d) {
-      return (
-        leftLegendSpace + (d.t_offset / data.total_duration_seconds) * width
-      );
-    })
-    .attr("fill", function (d) {
-      return d.colour;
-    })
-    .attr("cy", function (d) {
-      return topLegendSpace + d.cy;
+  const updateProcesses = makeKeyedLayer(svg, (d) =>
+    svgElement("rect", {
+      id: d.id,
+      // Processes sharing a lane are only highlighted over their lifetime
+      x: d.t_offset === null ? 0 : layout.x(d.t_offset),
+      width:
+        d.t_offset === null
+          ? width + leftLegendSpace
+          : Math.max(layout.widthOf(d.duration), 1),
+      y: d.y + topLegendSpace,
+      height: d.height,
+      class: "pg_process",
     })
-    .attr("r", function (d) {
-      return d.size;
-    })
-    .attr("class", "pg_event")
-    .on("click", function (evt, d) {
-      setSidebarContent(
-        d.id,
-        d.mouseover_content,
-        true,
-        d.primary_related_process_ids,
-        d.secondary_related_process_ids
-      );
+  );
+
+  const updateLabels = makeKeyedLayer(svg, (d) => {
+    const label = svgElement("text", {
+      x: d.t_offset === null ? 0 : layout.x(d.t_offset),
+      y: d.y + topLegendSpace,
+      "font-size": "10px",
+    });
+    label.textContent = "" + d.pid;
+    label.addEventListener("click", function (evt) {
       evt.stopPropagation();
+    });
+    return label;
+  });
+
+  const updateStatements = makeKeyedLayer(svg, (d) => {
+    const rect = svgElement("rect", {
+      id: d.id,
+      class: "pg_stmt",
+      x: layout.x(d.t_offset),
+      y: d.y + topLegendSpace,
+      width: layout.widthOf(d.duration),
+      height: d.height,
+    });
+    rect.style.fill = d.colour;
+    return listen(rect, d, focusStatement);
+  });
+
+  const updateEvents = makeKeyedLayer(svg, (d) =>
+    listen(
+      svgElement("circle", {
+        id: d.id,
+        cx: layout.x(d.t_offset),
+        fill: d.colour,
+        cy: topLegendSpace + d.cy,
+        r: d.size,
+        class: "pg_event",
+      }),
+      d,
+      focusEvent
+    )
+  );
+
+  watchViewport(window.innerHeight, function (top, bottom) {
+    const [first, last] = lanes.between(
+      top - topLegendSpace,
+      bottom - topLegendSpace
+    );
+    const visible = (perLane) => perLane.slice(first, last).flat();
+
+    updateProcesses(visible(processesByLane));
+    updateLabels(visible(processesByLane));
+    updateStatements(visible(statementsByLane));
+    updateEvents(visible(eventsByLane));
+
+    highlighter.refresh();
+  });
+}
+
+// Scales the canvas for sharp drawing on high-density screens
+function makeCanvas(container, width, height) {
+  const ratio = window.devicePixelRatio || 1;
+  const canvas = document.createElement("canvas");
+  Object.assign(canvas.style, {
+    position: "absolute",
+    left: 0,
+    top: 0,
+    width: width + "px",
+  });
+  container.append(canvas);
+  const ctx = canvas.getContext("2d");
+
+  const layer = {
+    canvas,
+    ctx,
+    width,
+    height,
+    resize: function (height) {
+      this.height = height;
+      canvas.width = Math.ceil(width * ratio);
+      canvas.height = Math.ceil(height * ratio);
+      canvas.style.height = height + "px";
+      ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    },
+  };
+  layer.resize(height);
+  return layer;
+}
+
+// Indexes elements per row, sorted by start time. Alongside the start times
+// it keeps the running maximum of the end times, so that the elements
+// overlapping a time window can be found with two binary searches.
+function makeRowIndex(rowCount, count, rowOf, startOf, endOf) {
+  const perRow = Array.from({ length: rowCount }, () => []);
+  for (let i = 0; i < count; i++) {
+    const row = rowOf(i);
+    if (row >= 0) perRow[row].push(i);
+  }
+
+  return perRow.map((indices) => {
+    indices.sort((i, j) => startOf(i) - startOf(j));
+    const starts = Float64Array.from(indices, startOf);
+    const maxEnds = new Float64Array(indices.length);
+    let maxEnd = -Infinity;
+    indices.forEach((i, k) => {
+      maxEnd = Math.max(maxEnd, endOf(i));
+      maxEnds[k] = maxEnd;
+    });
+    return { indices, starts, maxEnds, endOf };
+  });
+}
+
+// Calls visit() for the elements in a row that overlap [t0, t1], in order
+function queryRow(row, t0, t1, visit) {
+  const hi = bisect(row.starts, t1, true);
+  for (let k = bisect(row.maxEnds, t0, false); k < hi; k++) {
+    const i = row.indices[k];
+    if (row.endOf(i) >= t0) visit(i);
+  }
+}
+
+// Picks the finest level of detail whose buckets are at least a pixel wide, if
+// they are still narrow enough to stand in for the statements in them
+function chooseLodLevel(levels, pixelsPerUsec) {
+  for (const level of levels) {
+    const pixels = level.bucket_usec * pixelsPerUsec;
+    if (pixels >= 1) {
+      return pixels < 4 ? level : null;
+    }
+  }
+  return levels.length ? levels[levels.length - 1] : null;
+}
+
+function drawCanvas(data, layout, sidebarContent) {
+  const { width, leftLegendSpace, topLegendSpace } = layout;
+  const fullWidth = width + leftLegendSpace;
+  const fullHeight = data.total_height + topLegendSpace;
+  const totalDuration = data.total_duration_seconds;
+
+  const container = htmlElement("div");
+  Object.assign(container.style, {
+    position: "relative",
+    width: fullWidth + "px",
+    height: fullHeight + "px",
+  });
+  document.getElementById("timeline").append(container);
+
+  const axis = svgElement("svg", { width: fullWidth, height: topLegendSpace });
+  axis.style.position = "absolute";
+  const axisGroup = svgElement("g");
+  axis.append(axisGroup);
+  container.append(axis);
+
+  // The canvases only cover the part of the timeline that is scrolled into
+  // view, and stick to the top of it as it scrolls. Process highlights go
+  // underneath everything else, the focused element's outline on top, so
+  // that neither needs the timeline itself redrawn.
+  const sticky = htmlElement("div");
+  Object.assign(sticky.style, { position: "sticky", top: 0 });
+  container.append(sticky);
+  const background = makeCanvas(sticky, fullWidth, 0);
+  const timeline = makeCanvas(sticky, fullWidth, 0);
+  const overlay = makeCanvas(sticky, fullWidth, 0);
+  const layers = [background, timeline, overlay];
+
+  // The part of the timeline's height that is in view
+  const viewport = { top: 0, bottom: 0 };
+
+  // Clears a layer and draws on it in the timeline's coordinates
+  const paint = (layer, draw) => {
+    layer.ctx.clearRect(0, 0, fullWidth, layer.height);
+    layer.ctx.save();
+    layer.ctx.translate(0, -viewport.top);
+    draw(layer.ctx);
+    layer.ctx.restore();
+  };
+
+  // The visible time window, in seconds from the start of the report
+  const view = { start: 0, end: totalDuration };
+  const x = (offset) =>
+    leftLegendSpace + ((offset - view.start) / (view.end - view.start)) * width;
+  const widthOf = (duration) => (duration / (view.end - view.start)) * width;
+  const timeAt = (px) =>
+    view.start + ((px - leftLegendSpace) / width) * (view.end - view.start);
+
+  const lanes = makeLanes(data.processes);
+  const processesByLane = lanes.group(data.processes, (d) => d.y);
+
+  const statementRows = makeRowIndex(
+    lanes.count,
+    data.statements.length,
+    (i) => lanes.at(data.statements[i].y),
+    (i) => data.statements[i].t_offset,
+    (i) => data.statements[i].t_offset + data.statements[i].duration
+  );
+  const eventRows = makeRowIndex(
+    lanes.count,
+    data.events.length,
+    (i) => lanes.at(data.events[i].cy),
+    (i) => data.events[i].t_offset,
+    (i) => data.events[i].t_offset
+  );
+  const maxEventSize = data.events.reduce((m, d) => Math.max(m, d.size), 0);
+
+  const lodLevels = (data.lod_levels || []).map((level) =>
+    Object.assign({}, level, {
+      rows: makeRowIndex(
+        lanes.count,
+        level.bucket.length,
+        (i) => lanes.at(level.y[i]),
+        (i) => (level.bucket[i] * level.bucket_usec) / 1e6,
+        (i) => ((level.bucket[i] + 1) * level.bucket_usec) / 1e6
+      ),
     })
-    .on("mouseover", function (evt, d) {
-      setSidebarContent(
-        d.id,
-        d.mouseover_content,
-        false,
-        d.primary_related_process_ids,
-        d.secondary_related_process_ids
+  );
+  const currentLodLevel = () =>
+    chooseLodLevel(lodLevels, width / ((view.end - view.start) * 1e6));
+
+  // Everything that can be hovered is described by a "shape", which knows
+  // where it is drawn in the current view.
+  const statementShape = (i) => {
+    const d = data.statements[i];
+    return {
+      id: d.id,
+      box: () => [
+        x(d.t_offset),
+        d.y + topLegendSpace,
+        // Keep very short statements visible and hoverable
+        Math.max(widthOf(d.duration), 1),
+        d.height,
+      ],
+      focus: (lock) =>
+        setSidebarContent(d.id, sidebarContent.statement(d), lock),
+    };
+  };
+  const eventShape = (i) => {
+    const d = data.events[i];
+    return {
+      id: d.id,
+      circle: () => [x(d.t_offset), d.cy + topLegendSpace, d.size],
+      focus: (lock) =>
+        setSidebarContent(
+          d.id,
+          sidebarContent.event(d),
+          lock,
+          d.primary_related_process_ids,
+          d.secondary_related_process_ids
+        ),
+    };
+  };
+  const bucketShape = (level, i) => {
+    const id = "lod_" + level.bucket_usec + "_" + i;
+    const y = level.y[i];
+    return {
+      id,
+      box: () => [
+        x((level.bucket[i] * level.bucket_usec) / 1e6),
+        y + topLegendSpace,
+        widthOf(level.bucket_usec / 1e6),
+        lanes.height(lanes.at(y)),
+      ],
+      focus: (lock) =>
+        setSidebarContent(id, sidebarContent.bucket(level, i), lock),
+    };
+  };
+
+  const contains = (shape, px, py) => {
+    if (shape.circle) {
+      const [cx, cy, r] = shape.circle();
+      return (px - cx) ** 2 + (py - cy) ** 2 <= r ** 2;
+    }
+    const [bx, by, bw, bh] = shape.box();
+    return px >= bx && px <= bx + bw && py >= by && py <= by + bh;
+  };
+
+  // Returns the shape drawn on top at a point, if any
+  const shapeAt = (px, py) => {
+    const row = lanes.at(py - topLegendSpace);
+    if (row < 0 || px < leftLegendSpace) return null;
+
+    const t = timeAt(px);
+    let found = null;
+    const check = (shape) => {
+      if (contains(shape, px, py)) found = shape;
+    };
+
+    const eventSlack = (maxEventSize / width) * (view.end - view.start);
+    queryRow(eventRows[row], t - eventSlack, t + eventSlack, (i) =>
+      check(eventShape(i))
+    );
+    if (found) return found;
+
+    const level = currentLodLevel();
+    if (level) {
+      queryRow(level.rows[row], t, t, (i) => check(bucketShape(level, i)));
+    } else {
+      const slack = (1 / width) * (view.end - view.start);
+      queryRow(statementRows[row], t - slack, t, (i) =>
+        check(statementShape(i))
       );
-      evt.stopPropagation();
-    })
-    .on("mouseout", function (d) {
-      resetSidebarContent(false);
+    }
+    return found;
+  };
+
+  const outline = (c, shape) => {
+    c.beginPath();
+    if (shape.circle) {
+      const [cx, cy, r] = shape.circle();
+      c.arc(cx, cy, r, 0, 2 * Math.PI);
+    } else {
+      c.rect(...shape.box());
+    }
+    c.stroke();
+  };
+
+  const shapesById = new Map();
+  let focused = null;
+  let brush = null;
+
+  const drawOverlay = () =>
+    paint(overlay, (ctx) => {
+      if (focused) {
+        ctx.strokeStyle = "rgb(255, 200, 200)";
+        ctx.lineWidth = 3;
+        outline(ctx, focused);
+      }
+
+      if (brush) {
+        const top = Math.max(viewport.top, topLegendSpace);
+        ctx.fillStyle = "rgba(100, 100, 100, 0.2)";
+        ctx.fillRect(
+          Math.min(brush.from, brush.to),
+          top,
+          Math.abs(brush.to - brush.from),
+          viewport.bottom - top
+        );
+      }
     });
+
+  const processesById = new Map(data.processes.map((d) => [d.id, d]));
+  let highlighted = [[], []];
+
+  // Where a process that shares its lane is drawn, at least a pixel wide
+  const lifetimeExtent = (p) => {
+    const x0 = x(p.t_offset);
+    return [x0, Math.max(x0 + widthOf(p.duration), x0 + 1)];
+  };
+
+  const drawBackground = () =>
+    paint(background, (ctx) => {
+      const fillProcesses = (ids, colour) => {
+        ctx.fillStyle = colour;
+        (ids || []).forEach((procid) => {
+          const p = processesById.get(procid);
+          if (!p) return;
+          if (p.t_offset === null) {
+            ctx.fillRect(0, p.y + topLegendSpace, fullWidth, p.height);
+          } else {
+            // Processes sharing a lane are only highlighted over their lifetime
+            const [x0, x1] = lifetimeExtent(p);
+            ctx.fillRect(x0, p.y + topLegendSpace, x1 - x0, p.height);
+          }
+        });
+      };
+      // Same colours as the process highlight classes in lupa.embed.css
+      fillProcesses(highlighted[0], "rgb(240, 180, 180)");
+      fillProcesses(highlighted[1], "rgb(200, 200, 200)");
+    });
+
+  const drawTimeline = () => {
+    layout.scale.domain([
+      data.start_time_unix_seconds + view.start,
+      data.start_time_unix_seconds + view.end,
+    ]);
+    layout.axis(axisGroup);
+
+    // Lanes that are at least partly in view
+    const [first, last] = lanes.between(
+      viewport.top - topLegendSpace - maxEventSize,
+      viewport.bottom - topLegendSpace + maxEventSize
+    );
+    const visibleLanes = (draw) => {
+      for (let lane = first; lane < last; lane++) draw(lane);
+    };
+
+    paint(timeline, (ctx) => {
+      ctx.save();
+      ctx.beginPath();
+      ctx.rect(leftLegendSpace, 0, width, fullHeight);
+      ctx.clip();
+
+      const level = currentLodLevel();
+      visibleLanes((lane) => {
+        if (level) {
+          queryRow(level.rows[lane], view.start, view.end, (i) => {
+            ctx.fillStyle = level.colour[i];
+            ctx.fillRect(...bucketShape(level, i).box());
+          });
+        } else {
+          queryRow(statementRows[lane], view.start, view.end, (i) => {
+            ctx.fillStyle = data.statements[i].colour;
+            ctx.fillRect(...statementShape(i).box());
+          });
+        }
+      });
+
+      const eventSlack = (maxEventSize / width) * (view.end - view.start);
+      visibleLanes((lane) => {
+        queryRow(
+          eventRows[lane],
+          view.start - eventSlack,
+          view.end + eventSlack,
+          (i) => {
+            const [cx, cy, r] = eventShape(i).circle();
+            ctx.fillStyle = data.events[i].colour;
+            ctx.beginPath();
+            ctx.arc(cx, cy, r, 0, 2 * Math.PI);
+            ctx.fill();
+          }
+        );
+      });
+
+      ctx.restore();
+
+      ctx.font = "10px sans-serif";
+      ctx.fillStyle = "black";
+      visibleLanes((lane) => {
+        processesByLane[lane].forEach((d) => {
+          if (d.t_offset === null) {
+            ctx.fillText("" + d.pid, 0, d.y + topLegendSpace);
+            return;
+          }
+          // Label where the process starts, or at the edge if before the view
+          const [x0, x1] = lifetimeExtent(d);
+          if (x1 >= leftLegendSpace && x0 <= fullWidth) {
+            const labelX = Math.max(x0, leftLegendSpace);
+            ctx.fillText("" + d.pid, labelX, d.y + topLegendSpace);
+          }
+        });
+      });
+    });
+
+    drawBackground();
+    drawOverlay();
+  };
+
+  let redrawRequested = false;
+  const redraw = () => {
+    if (redrawRequested) return;
+    redrawRequested = true;
+    window.requestAnimationFrame(() => {
+      redrawRequested = false;
+      drawTimeline();
+    });
+  };
+
+  // Shortest window to zoom into; a little over a pixel per microsecond
+  const minSpan = Math.min(totalDuration, (width / 1e6) * 1.5);
+
+  const setView = (start, end) => {
+    const span = Math.min(Math.max(end - start, minSpan), totalDuration);
+    start = Math.min(Math.max(start, 0), totalDuration - span);
+    view.start = start;
+    view.end = start + span;
+    redraw();
+  };
+
+  highlighter = {
+    clear: function () {
+      highlighted = [[], []];
+      focused = null;
+      drawBackground();
+      drawOverlay();
+    },
+    highlight: function (id, processes1, processes2) {
+      highlighted = [processes1, processes2];
+      focused = shapesById.get(id) || null;
+      drawBackground();
+      drawOverlay();
+    },
+  };
+
+  const focusShape = (shape, lock) => {
+    shapesById.clear();
+    if (shape) shapesById.set(shape.id, shape);
+    shape.focus(lock);
+  };
+
+  let hovered = null;
+  let drag = null;
+  // Set between the end of a drag and the click event that follows it
+  let dragged = false;
+
+  const listeners = {
+    mousedown: function (evt) {
+      drag = {
+        from: evt.offsetX,
+        view: Object.assign({}, view),
+        brush: evt.shiftKey,
+        moved: false,
+      };
+      evt.preventDefault();
+    },
+    mousemove: function (evt) {
+      if (drag) {
+        const dx = evt.offsetX - drag.from;
+        drag.moved = drag.moved || Math.abs(dx) > 3;
+        if (drag.brush) {
+          brush = { from: drag.from, to: evt.offsetX };
+          drawOverlay();
+        } else if (drag.moved) {
+          const shift = (dx / width) * (drag.view.end - drag.view.start);
+          setView(drag.view.start - shift, drag.view.end - shift);
+        }
+        return;
+      }
+
+      const shape = shapeAt(evt.offsetX, evt.offsetY + viewport.top);
+      if ((shape && shape.id) === (hovered && hovered.id)) return;
+      hovered = shape;
+      if (shape) {
+        focusShape(shape, false);
+      } else {
+        resetSidebarContent(false);
+      }
+    },
+    mouseout: function () {
+      hovered = null;
+      resetSidebarContent(false);
+    },
+    click: function (evt) {
+      if (dragged) {
+        evt.stopPropagation();
+        return;
+      }
+
+      const shape = shapeAt(evt.offsetX, evt.offsetY + viewport.top);
+      if (shape) {
+        focusShape(shape, true);
+        evt.stopPropagation();
+      }
+    },
+    dblclick: function () {
+      setView(0, totalDuration);
+    },
+    wheel: function (evt) {
+      const span = view.end - view.start;
+      if (evt.ctrlKey || evt.metaKey) {
+        // Zoom around the time under the pointer (also what pinching does)
+        const anchor = timeAt(evt.offsetX);
+        const factor = Math.exp(evt.deltaY * 0.002);
+        setView(
+          anchor - (anchor - view.start) * factor,
+          anchor + (view.end - anchor) * factor
+        );
+      } else if (evt.shiftKey || Math.abs(evt.deltaX) > Math.abs(evt.deltaY)) {
+        const delta = evt.deltaX || evt.deltaY;
+        setView(
+          view.start + (delta / width) * span,
+          view.end + (delta / width) * span
+        );
+      } else {
+        return;
+      }
+      evt.preventDefault();
+    },
+  };
+  Object.entries(listeners).forEach(([type, listener]) =>
+    overlay.canvas.addEventListener(type, listener)
+  );
+
+  window.addEventListener("mouseup", function (evt) {
+    if (drag && drag.brush && brush) {
+      const from = timeAt(Math.min(brush.from, brush.to));
+      const to = timeAt(Math.max(brush.from, brush.to));
+      brush = null;
+      if (drag.moved) {
+        setView(from, to);
+      } else {
+        drawOverlay();
+      }
+    }
+    if (drag && drag.moved) {
+      dragged = true;
+      window.setTimeout(() => {
+        dragged = false;
+      });
+    }
+    drag = null;
+  });
+
+  watchViewport(0, function (top, bottom) {
+    const height = Math.min(bottom - top, fullHeight);
+    if (height !== overlay.height) {
+      sticky.style.height = height + "px";
+      layers.forEach((layer) => layer.resize(height));
+    }
+    viewport.top = Math.min(Math.max(top, 0), fullHeight - height);
+    viewport.bottom = viewport.top + height;
+    drawTimeline();
+  });
+}
+
+async function draw() {
+  const rightSpacing = 20;
+  const topLegendSpace = 30;
+  const leftLegendSpace = 50;
+  const width =
+    document.getElementById("timeline").clientWidth -
+    rightSpacing -
+    leftLegendSpace;
+  const data = await loadData();
+  const sidebarContent = makeSidebarContentBuilders(data);
+
+  const scale = makeScale(
+    [data.start_time_unix_seconds, data.end_time_unix_seconds],
+    [leftLegendSpace, width + leftLegendSpace]
+  );
+  const axis = makeAxis(scale, function (x) {
+    const t = new Date(x * 1000);
+    const hs = t.getHours().toString().padStart(2, "0");
+    const ms = t.getMinutes().toString().padStart(2, "0");
+    const ss = t.getSeconds().toString().padStart(2, "0");
+    const [from, to] = scale.domain();
+    if (to - from < 10) {
+      // Zoomed in far enough that ticks are less than a second apart
+      const millis = t.getMilliseconds().toString().padStart(3, "0");
+      return hs + ":" + ms + ":" + ss + "." + millis;
+    }
+    return hs + ":" + ms + ":" + ss;
+  });
+
+  const layout = {
+    width,
+    leftLegendSpace,
+    topLegendSpace,
+    scale,
+    axis,
+    x: (offset) =>
+      leftLegendSpace + (offset / data.total_duration_seconds) * width,
+    widthOf: (duration) => (duration / data.total_duration_seconds) * width,
+  };
+
+  if (data.renderer === "canvas") {
+    drawCanvas(data, layout, sidebarContent);
+  } else {
+    drawSvg(data, layout, sidebarContent);
+  }
 }
 
-$("#timeline").on("click", function () {
+document.getElementById("timeline").addEventListener("click", function () {
   resetSidebarContent(true);
 });
 
@@ -1,23 +1,46 @@
+import base64
+import bz2
 import datetime
+import gzip
 import io
+import json
+import lzma
 import os
+import re
 from pathlib import Path
 
 import click.testing
+import dateutil.parser
 import dateutil.tz
 import pytest
 
+from . import lupa
 from .__main__ import main
 from .lupa import (
+    CarrierFormat,
+    ColumnarModel,
+    Compression,
     HoldingLockLogEntry,
+    ParseOptions,
+    PayloadFormat,
+    ProcessSortOrder,
+    VizOptions,
     classify_sql,
+    detect_compression,
+    infer_log_line_prefix,
+    iter_json_array,
+    make_dispatch_matcher,
     make_prefix_parser,
     parse_duration_log_line,
     parse_holding_lock_log_line,
+    parse_log_data_automagically,
     parse_log_lines_automagically,
     parse_log_prefix,
     parse_postgres_lines,
+    parse_postgres_lines_columnar,
+    parse_timestamp,
     run_analyzer,
+    sniff_carrier_format,
     split_simple_lines,
     visualize,
 )
@@ -61,6 +84,18 @@ SLIGHTLY_CORRUPT_LOG_DATA = """
 """
 
 
+def _embedded_text(html: str) -> str:
+    # The report data as embedded in the <script id="data"> element
+    return html.split('<script id="data" ')[1].split(">", 1)[1].split("</script>")[0]
+
+
+def _embedded_data(html: str):
+    text = _embedded_text(html)
+    if 'data-encoding="gzip+base64"' in html:
+        text = gzip.decompress(base64.b64decode(text)).decode()
+    return json.loads(text)
+
+
 def test_parse_holding_lock_log_line():
     entry = parse_holding_lock_log_line("2845932. Wait queue: 2864876, 2857466.")
     assert entry == HoldingLockLogEntry(
@@ -120,6 +155,21 @@ def test_parse_log_prefix_new_style():
     assert entry.timestamp == datetime.datetime(2022, 5, 22, 11, 9, 34, tzinfo=oslo)
 
 
+def test_parse_timestamp_fast_path_agrees_with_dateutil():
+    for s, expected in [
+        ("2022-05-22 10:50:29 CEST", "2022-05-22 10:50:29+02:00"),
+        ("2022-01-22 10:50:29.1 CET", "2022-01-22 10:50:29.1+01:00"),
+        ("2022-05-22 10:50:29.123 UTC", "2022-05-22 10:50:29.123+00:00"),
+        ("2022-05-22T08:50:29.123456789Z", "2022-05-22 08:50:29.123456+00:00"),
+    ]:
+        assert parse_timestamp(s) == dateutil.parser.parse(expected)
+
+    # Unknown shapes still go through dateutil.
+    assert parse_timestamp("2022-05-22T10:50:29+02:00") == datetime.datetime(
+        2022, 5, 22, 8, 50, 29, tzinfo=datetime.timezone.utc
+    )
+
+
 def test_parse_tiny_log():
     model = parse_postgres_lines(split_simple_lines(TINY_LOG_DATA))
     assert len(model.events) == 7
@@ -127,6 +177,190 @@ def test_parse_tiny_log():
     assert len(model.processes) == 10
 
 
+def test_parse_in_parallel_matches_serial(monkeypatch):
+    monkeypatch.setattr(lupa, "PARALLEL_CHUNK_LINES", 7)
+
+    with open(EXAMPLES_DIR / "example.log", "r") as f:
+        lines = list(parse_log_lines_automagically(f))
+
+    # Each worker has to find the right prefix matcher again, so the number of
+    # prefix fallbacks may differ.
+    serial = parse_postgres_lines(lines)
+    parallel = parse_postgres_lines(lines, ParseOptions(jobs=3))
+    assert parallel.dict(exclude={"stats"}) == serial.dict(exclude={"stats"})
+    assert parallel.stats.parsed_lines == serial.stats.parsed_lines
+
+    unmerged = split_simple_lines(SLIGHTLY_CORRUPT_LOG_DATA)
+    assert parse_postgres_lines(unmerged, ParseOptions(jobs=2)).dict(
+        exclude={"stats"}
+    ) == parse_postgres_lines(unmerged).dict(exclude={"stats"})
+
+
+def test_adaptive_prefix_matching_stats():
+    model = parse_postgres_lines(split_simple_lines(TINY_LOG_DATA))
+    assert model.stats.parsed_lines == 8
+    assert model.stats.prefix_fallback_lines == 0
+
+    # Without inference, the example log needs the second default matcher,
+    # which is found on the first line and then used for the rest.
+    with open(EXAMPLES_DIR / "example.log", "r") as f:
+        model = parse_log_data_automagically(
+            f, ParseOptions(infer_log_line_prefix=False)
+        )
+    assert model.stats.parsed_lines == 327
+    assert model.stats.prefix_fallback_lines == 1
+
+
+def test_infer_log_line_prefix():
+    assert infer_log_line_prefix(TINY_LOG_DATA.splitlines()) == "%t [%p-%l] %q%u@%d "
+    assert (
+        infer_log_line_prefix(
+            [
+                "2022-05-22 10:50:29.123 CEST [2929634] LOG:  checkpoint starting",
+                "2022-05-22 10:50:29.123 CEST [2929634] foo@bar LOG:  duration: 1.0 ms",
+            ]
+        )
+        == "%m [%p] %q%u@%d "
+    )
+    assert (
+        infer_log_line_prefix(
+            [
+                "2022-05-22 10:50:29 UTC:10.0.0.1(5432):foo@bar:[2929634]:LOG:  hello",
+                "2022-05-22 10:50:30 UTC:[local]:foo@bar:[2929635]:ERROR:  oops",
+            ]
+        )
+        == "%t:%r:%u@%d:[%p]:"
+    )
+    assert infer_log_line_prefix(["no prefix here LOG:  hello"]) is None
+
+    with open(EXAMPLES_DIR / "example.log", "r") as f:
+        model = parse_log_data_automagically(f)
+    assert model.stats.inferred_log_line_prefix == "%t [%p-%l] %q%u@%d (%a) "
+    assert model.stats.prefix_fallback_lines == 0
+
+
+def test_prefix_sessions_are_shared():
+    parse = lupa._make_prefix_record_parser("%t [%p-%l] %q%u@%d ")
+    first = parse("2022-05-22 10:50:43 CEST [2864876-56] foo@foo ")
+    second = parse("2022-05-22 10:50:44 CEST [2864876-57] foo@foo ")
+    other = parse("2022-05-22 10:50:44 CEST [2864877-3] foo@foo ")
+    assert first and second and other
+    assert first.session is second.session
+    assert (second.pid, second.log_line_no, second.username) == (2864876, 57, "foo")
+    assert other.session is not first.session
+    assert other.username is first.username
+
+
+def test_parse_default_prefix_without_log_line_numbers():
+    model = parse_postgres_lines(
+        split_simple_lines(
+            "2022-05-22 10:50:29.123 CEST [2929634] LOG:  duration: 1.500 ms"
+            "  statement: SELECT 1\n"
+        )
+    )
+    [stmt] = model.statements
+    assert stmt.pid == 2929634
+    assert stmt.log_line_no is None
+    assert stmt.context.timestamp == stmt.end_time
+    assert stmt.duration == 0.0015
+
+
+def test_columnar_model_round_trip():
+    with open(EXAMPLES_DIR / "example.log", "r") as f:
+        lines = list(parse_log_lines_automagically(f))
+
+    model = parse_postgres_lines(lines)
+    columnar = parse_postgres_lines_columnar(lines)
+    assert len(columnar.statement_start_usec) == len(model.statements)
+    assert len(columnar.event_time_usec) == len(model.events)
+    assert columnar.stats == model.stats
+    assert columnar.to_model() == model
+    assert ColumnarModel.from_model(model).to_model() == model
+
+    out = io.StringIO()
+    visualize(columnar, out)
+    expected = io.StringIO()
+    visualize(model, expected)
+    assert out.getvalue() == expected.getvalue()
+
+
+def test_columnar_model_dump_and_load():
+    with open(EXAMPLES_DIR / "example.log", "r") as f:
+        model = lupa.parse_log_data_columnar(f)
+    time = parse_timestamp("2022-10-30 02:01:00 CET")
+    model.add_process(1, time)
+    model.add_event(
+        time,
+        lupa.LogPrefixInfo(timestamp=time, pid=1),
+        lupa.EventType.DEADLOCK,
+        None,
+        (1, model.process_pid[0]),
+        (),
+    )
+
+    out = io.BytesIO()
+    model.dump(out)
+    loaded = ColumnarModel.load(io.BytesIO(out.getvalue()))
+    assert loaded.to_model() == model.to_model()
+    assert loaded.event_primary_related_pids[-1] == (1, model.process_pid[0])
+
+    with pytest.raises(ValueError):
+        ColumnarModel.load(io.BytesIO(out.getvalue()[:-1]))
+
+    expected = io.StringIO()
+    visualize(model, expected)
+    out = io.StringIO()
+    visualize(loaded, out)
+    assert out.getvalue() == expected.getvalue()
+
+
+def test_parse_log_file_cached(tmp_path, monkeypatch):
+    log_path = tmp_path / "tiny.log"
+    log_path.write_text(TINY_LOG_DATA)
+    cache_dir = str(tmp_path / "cache")
+
+    with log_path.open() as f:
+        model = lupa.parse_log_file_cached(f, cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("parsed again")
+
+    with monkeypatch.context() as m:
+        m.setattr(lupa, "parse_log_data_columnar", fail)
+        with log_path.open() as f:
+            cached = lupa.parse_log_file_cached(f, cache_dir, ParseOptions(jobs=2))
+    assert cached.to_model() == model.to_model()
+
+    # Unreadable entries are parsed again and replaced
+    [entry] = os.listdir(cache_dir)
+    for contents in (b"", b"{}\n", b"\x80\x04garbage"):
+        (Path(cache_dir) / entry).write_bytes(contents)
+        with log_path.open() as f:
+            reparsed = lupa.parse_log_file_cached(f, cache_dir)
+        assert reparsed.to_model() == model.to_model()
+    with open(Path(cache_dir) / entry, "rb") as f:
+        truncated = f.read()[:-1]
+    (Path(cache_dir) / entry).write_bytes(truncated)
+    with log_path.open() as f:
+        lupa.parse_log_file_cached(f, cache_dir)
+    assert len((Path(cache_dir) / entry).read_bytes()) == len(truncated) + 1
+
+    # Other options, another encoding, other contents and unnamed input aren't
+    # served from cache
+    with log_path.open() as f:
+        lupa.parse_log_file_cached(
+            f, cache_dir, ParseOptions(infer_log_line_prefix=False)
+        )
+    with log_path.open(encoding="latin-1") as f:
+        lupa.parse_log_file_cached(f, cache_dir)
+    log_path.write_text(TINY_LOG_DATA + TINY_LOG_DATA)
+    with log_path.open() as f:
+        lupa.parse_log_file_cached(f, cache_dir)
+    lupa.parse_log_file_cached(io.StringIO(TINY_LOG_DATA), cache_dir)
+    assert len(os.listdir(cache_dir)) == 4
+
+
 def test_visualize_tiny_log():
     model = parse_postgres_lines(split_simple_lines(TINY_LOG_DATA))
     visualize(model, io.StringIO())
@@ -137,6 +371,335 @@ def test_visualize_slightly_corrupt_tiny_log():
     visualize(model, io.StringIO())
 
 
+def test_visualize_embeds_raw_sidebar_fields():
+    model = parse_postgres_lines_columnar(split_simple_lines(TINY_LOG_DATA))
+    out = io.StringIO()
+    visualize(model, out, VizOptions(payload_format=PayloadFormat.FULL))
+    html = out.getvalue()
+
+    data = _embedded_data(html)
+    [stmt] = data["statements"]
+    assert "mouseover_content" not in stmt
+    assert data["texts"][stmt["text"]].strip() == "SELECT stuff FROM mytbl WHERE x = 1"
+    assert data["contexts"][stmt["context"]] == {
+        "pid": 2864876,
+        "username": "foo",
+        "database": "foo",
+        "application_name": None,
+    }
+    assert stmt["log_line_no"] == 56
+    assert data["utc_offsets"] == [
+        {
+            "start_time_unix_usec": data["start_time_unix_usec"],
+            "offset_seconds": 7200,
+            "name": "",
+        }
+    ]
+
+
+def test_visualize_escapes_script_end_in_statements():
+    sql = "SELECT '</script><script>alert(1)</script>' & 1"
+    model = parse_postgres_lines_columnar(
+        split_simple_lines(
+            "2022-05-22 10:50:43 CEST [1000-1] foo@foo LOG:  duration: 1.000 ms  "
+            f"statement: {sql}\n"
+        )
+    )
+    out = io.StringIO()
+    visualize(model, out, VizOptions(payload_format=PayloadFormat.FULL))
+    html = out.getvalue()
+
+    assert "<script>alert" not in html
+    data = _embedded_data(html)
+    assert data["texts"][data["statements"][0]["text"]].strip() == sql
+
+    escaped = lupa.escape_json_for_script(
+        json.dumps("</script>\u2028", ensure_ascii=False)
+    )
+    assert escaped == '"\\u003c/script\\u003e\\u2028"'
+
+
+def test_report_is_self_contained():
+    model = parse_postgres_lines_columnar(split_simple_lines(TINY_LOG_DATA))
+    out = io.StringIO()
+    visualize(model, out)
+    assert "<script src=" not in out.getvalue()
+    assert "<link " not in out.getvalue()
+
+
+def test_template_cache(tmp_path):
+    assert lupa._template_environment() is lupa._template_environment()
+
+    model = parse_postgres_lines_columnar(split_simple_lines(TINY_LOG_DATA))
+    cache_dir = tmp_path / "templates"
+    out = io.StringIO()
+    visualize(model, out, VizOptions(template_cache_dir=str(cache_dir)))
+    # The report template and the three templates it includes
+    assert len(list(cache_dir.iterdir())) == 4
+
+    uncached = io.StringIO()
+    visualize(model, uncached)
+    assert out.getvalue() == uncached.getvalue()
+
+
+def test_compact_payload():
+    model = parse_postgres_lines_columnar(
+        split_simple_lines(
+            TINY_LOG_DATA
+            + "2022-05-22 10:57:50 CEST [1000-1] foo@foo LOG:  duration: 1.000 ms  "
+            "statement: SELECT '</script><script>alert(1)</script>'\n"
+        )
+    )
+    out = io.StringIO()
+    visualize(model, out, VizOptions(payload_format=PayloadFormat.FULL))
+    full = _embedded_data(out.getvalue())
+
+    out = io.StringIO()
+    visualize(model, out)
+    compact = _embedded_data(out.getvalue())
+    assert compact["format"] == "compact"
+    assert "<script>alert" not in out.getvalue()
+    assert "\n" not in _embedded_text(out.getvalue()).strip()
+
+    pids = compact["processes"]["pid"]
+    assert [f"process_{pid}" for pid in pids] == [p["id"] for p in full["processes"]]
+    assert compact["texts"] == full["texts"]
+
+    stmt = full["statements"][0]
+    assert compact["statements"]["duration_usec"] == [1074754, 1000]
+    assert (
+        stmt["process_element_id"]
+        == f"process_{pids[compact['statements']['process'][0]]}"
+    )
+
+    events = compact["events"]
+    for i, event in enumerate(full["events"]):
+        assert [
+            f"process_{pids[p]}" for p in events["primary_related_processes"][i]
+        ] == event["primary_related_process_ids"]
+        assert compact["event_types"][events["event_type"][i]] == event["event_type"]
+        assert compact["colours"][events["colour"][i]] == event["colour"]
+
+
+def test_compressed_payload():
+    model = parse_postgres_lines_columnar(split_simple_lines(TINY_LOG_DATA))
+    out = io.StringIO()
+    visualize(model, out)
+    plain = _embedded_data(out.getvalue())
+
+    out = io.StringIO()
+    visualize(model, out, VizOptions(compress_payload=True))
+    assert 'data-encoding="gzip+base64"' in out.getvalue()
+    assert _embedded_data(out.getvalue()) == plain
+
+
+def test_canvas_renderer_option():
+    result = click.testing.CliRunner().invoke(
+        main,
+        ["--renderer", "canvas", "--payload-format", "full"],
+        input=TINY_LOG_DATA,
+    )
+    assert result.exit_code == 0
+    data = _embedded_data(result.output)
+    assert data["renderer"] == "canvas"
+
+
+def test_lod_pyramid():
+    # (lane, process, start, end, class), with times in microseconds
+    statements = [
+        (0, 0, 0, 10, 0),
+        (0, 0, 5, 1000, 1),
+        (0, 2, 300, 300, 0),
+        (1, 1, 999, 1024, 2),
+    ]
+    [(finest_usec, finest), *_, (coarsest_usec, coarsest)] = lupa._make_lod_pyramid(
+        statements, 0, 1024, max_cells=10000
+    )
+    assert (finest_usec, coarsest_usec) == (1, 8)
+
+    # The long statement is counted in every bucket it overlaps, and most of
+    # the first bucket's time goes to it.
+    cell = coarsest[0, 0]
+    assert (cell.started, cell.in_progress, cell.max_duration) == (2, 0, 995)
+    assert cell.busy == {0: 8, 1: 3}
+    assert cell.busiest() == 0
+    assert cell.process == 0
+    cell = coarsest[0, 37]
+    assert (cell.started + cell.in_progress, cell.busiest()) == (2, 1)
+    assert cell.process == -1
+    assert coarsest[0, 124].busy == {1: 8}
+    assert (1, 125) in coarsest and (1, 127) in coarsest
+    assert len(finest) == 1000 + 25
+
+    # Levels that wouldn't save much over drawing the statements are skipped
+    assert len(lupa._make_lod_pyramid(statements, 0, 1024, max_cells=200)) == 1
+
+
+def test_visualize_lod_levels():
+    model = parse_postgres_lines_columnar(split_simple_lines(TINY_LOG_DATA))
+    out = io.StringIO()
+    visualize(model, out, VizOptions(renderer="canvas", lod_min_statements=1))
+    data = _embedded_data(out.getvalue())
+    assert data["lod_levels"] == []
+
+    model = parse_postgres_lines_columnar(
+        split_simple_lines(
+            "".join(
+                f"2022-05-22 10:50:{i % 60:02d} CEST [100-{i}] foo@foo LOG:  "
+                f"duration: 1.000 ms  statement: SELECT {i % 2}\n"
+                for i in range(600)
+            )
+        )
+    )
+    out = io.StringIO()
+    visualize(model, out, VizOptions(lod_min_statements=1))
+    data = _embedded_data(out.getvalue())
+    assert data["lod_levels"] == []
+
+    out = io.StringIO()
+    visualize(model, out, VizOptions(renderer="canvas", lod_min_statements=1))
+    data = _embedded_data(out.getvalue())
+    coarsest = data["lod_levels"][-1]
+    assert sum(coarsest["count"]) == 600
+    assert set(coarsest["process"]) == {0}
+    assert set(coarsest["y"]) == {0}
+    assert data["texts"][coarsest["text"][0]] == "select 0"
+
+    # Short-lived processes packed into one lane are aggregated together
+    model = parse_postgres_lines_columnar(
+        split_simple_lines(
+            "".join(
+                f"2022-05-22 10:{i // 60:02d}:{i % 60:02d} CEST [{1000 + i}-1] "
+                "foo@foo LOG:  duration: 1.000 ms  statement: SELECT 1\n"
+                for i in range(2000)
+            )
+        )
+    )
+    out = io.StringIO()
+    visualize(
+        model,
+        out,
+        VizOptions(
+            renderer="canvas", process_sort_order="packed", lod_min_statements=1
+        ),
+    )
+    data = _embedded_data(out.getvalue())
+    coarsest = data["lod_levels"][-1]
+    assert sum(coarsest["count"]) == 2000
+    assert set(coarsest["y"]) == {0}
+    assert None in coarsest["process"]
+
+
+def test_pack_lanes():
+    # Lifetimes that touch don't share a lane; the earliest lane to free up is
+    # reused first
+    lifetimes = [(0, 10), (5, 20), (10, 30), (11, 15), (21, 25), (31, 40)]
+    assert lupa._pack_lanes(lifetimes) == [0, 1, 2, 0, 0, 1]
+
+
+def test_visualize_packed_processes():
+    model = parse_postgres_lines_columnar(
+        split_simple_lines(
+            "".join(
+                f"2022-05-22 10:50:{i:02d} CEST [{100 + i}-1] foo@foo LOG:  "
+                f"duration: 1.000 ms  statement: SELECT {i}\n"
+                f"2022-05-22 10:50:{i:02d} CEST [{100 + i}-2] foo@foo LOG:  "
+                f"disconnection: session time: 0:00:00.002 user=foo database=foo "
+                f"host=[local]\n"
+                for i in range(10)
+            )
+        )
+    )
+    out = io.StringIO()
+    visualize(
+        model,
+        out,
+        VizOptions(
+            process_sort_order=ProcessSortOrder.PACKED,
+            payload_format=PayloadFormat.FULL,
+        ),
+    )
+    data = _embedded_data(out.getvalue())
+    assert len(data["processes"]) == 10
+    assert data["total_height"] == data["processes"][0]["height"]
+    assert {p["y"] for p in data["processes"]} == {0}
+    assert [p["t_offset"] for p in data["processes"]] == [
+        pytest.approx(i) for i in range(10)
+    ]
+    assert [p["duration"] for p in data["processes"]] == [pytest.approx(0.001)] * 10
+
+    # A lock holder that is only seen as a related process keeps its lane until
+    # the wait, so no other process is packed into it in the meantime
+    model = parse_postgres_lines_columnar(
+        split_simple_lines(
+            "2022-05-22 10:50:00 CEST [100-1] foo@foo LOG:  duration: 1.000 ms  "
+            "statement: BEGIN\n"
+            "2022-05-22 10:50:10 CEST [200-1] foo@foo LOG:  connection authorized: "
+            "user=foo database=foo\n"
+            "2022-05-22 10:50:11 CEST [200-2] foo@foo LOG:  disconnection: "
+            "session time: 0:00:01.000 user=foo database=foo host=[local]\n"
+            "2022-05-22 10:50:20 CEST [300-1] foo@foo DETAIL:  "
+            "Process holding the lock: 100. Wait queue: 300.\n"
+        )
+    )
+    out = io.StringIO()
+    visualize(
+        model,
+        out,
+        VizOptions(
+            process_sort_order=ProcessSortOrder.PACKED,
+            payload_format=PayloadFormat.FULL,
+        ),
+    )
+    data = _embedded_data(out.getvalue())
+    processes = {p["pid"]: p for p in data["processes"]}
+    assert processes[100]["t_offset"] == pytest.approx(0)
+    assert processes[100]["duration"] == pytest.approx(20.001)
+    assert processes[200]["y"] != processes[100]["y"]
+
+
+def test_utc_offset_segments():
+    oslo = dateutil.tz.gettz("Europe/Oslo")
+    start = int(dateutil.parser.parse("2022-10-29T12:00:00Z").timestamp() * 1e6)
+    end = int(dateutil.parser.parse("2022-11-02T12:00:00Z").timestamp() * 1e6)
+    transition = int(dateutil.parser.parse("2022-10-30T01:00:00Z").timestamp() * 1e6)
+
+    assert lupa._utc_offset_segments(
+        lambda usec: (lupa.EPOCH + datetime.timedelta(microseconds=usec)).astimezone(
+            oslo
+        ),
+        start,
+        end,
+    ) == [(start, 7200, "CEST"), (transition, 3600, "CET")]
+
+
+def test_utc_offset_changes_are_kept():
+    # Clocks go back from 03:00 CEST to 02:00 CET
+    model = parse_postgres_lines(
+        split_simple_lines(
+            "2022-10-30 02:59:00 CEST [1000-1] foo@foo LOG:  duration: 1.000 ms  "
+            "statement: SELECT 1\n"
+            "2022-10-30 02:01:00 CET [1000-2] foo@foo LOG:  duration: 1.000 ms  "
+            "statement: SELECT 2\n"
+        )
+    )
+    columnar = ColumnarModel.from_model(model)
+    assert len(columnar.tzinfos) == 2
+    for original, converted in zip(model.statements, columnar.to_model().statements):
+        assert converted.end_time.isoformat() == original.end_time.isoformat()
+
+    out = io.StringIO()
+    visualize(columnar, out, VizOptions(payload_format=PayloadFormat.FULL))
+    data = _embedded_data(out.getvalue())
+    assert data["end_time_string"].startswith("2022-10-30 02:01:00")
+    assert data["total_duration_string"] == "2m0.001s (120001ms)"
+    transition = int(dateutil.parser.parse("2022-10-30T01:01:00Z").timestamp() * 1e6)
+    assert [
+        (offset["start_time_unix_usec"], offset["offset_seconds"])
+        for offset in data["utc_offsets"]
+    ] == [(data["start_time_unix_usec"], 7200), (transition, 3600)]
+
+
 def test_classify_sql():
     one = "SELECT foo FROM bar WHERE quux = 99"
     two = "SELECT foo FROM bar WHERE quux = 123"
@@ -178,6 +741,173 @@ def test_continuation_lines():
     assert lines[2].line == "2022-05-22 10:50:29 CEST [2929626-2] log line three"
 
 
+def test_plain_text_input_is_streamed():
+    class LineOnlyFile(io.StringIO):
+        def read(self, size=-1):
+            if size is None or size < 0:
+                raise AssertionError("plain text input should not be read in one go")
+            return super().read(size)
+
+    lines = parse_log_lines_automagically(LineOnlyFile(TINY_LOG_DATA))
+    first = next(lines)
+    assert first.line.startswith("2022-05-22 10:50:29 CEST [2929634-1]")
+    assert len(list(lines)) == 9
+
+
+def test_memory_mapped_plain_text(tmp_path):
+    log_path = tmp_path / "corrupt.log"
+    log_path.write_bytes(
+        SLIGHTLY_CORRUPT_LOG_DATA.replace("\n", "\r\n", 5).encode()
+        # Entries that no dispatch key matches aren't decoded at all
+        + b"2022-05-22 10:58:00 CEST [1-1] foo@foo LOG:  statement: \xff\n"
+        + b"\t\xff\n\n"
+    )
+
+    with log_path.open() as f:
+        records = list(
+            lupa._iter_mapped_records(lupa._map_plain_text_file(f), "utf-8", None)
+        )
+    assert len(records) == 8
+    assert records[0].line.startswith("2022-05-22 10:50:29 CEST [2929634-2]")
+    assert records[0].line.endswith("foo database=foo\n\thello world")
+
+    with log_path.open() as f:
+        model = parse_log_data_automagically(f)
+    assert model == parse_log_data_automagically(io.StringIO(SLIGHTLY_CORRUPT_LOG_DATA))
+
+    assert lupa._map_plain_text_file(io.StringIO(TINY_LOG_DATA)) is None
+
+
+def test_parse_error_line_numbers(tmp_path, monkeypatch):
+    bad_line = (
+        "2022-05-22 10:58:00 CEST [1-1] foo@foo DETAIL:  "
+        "Process holding the lock: x. Wait queue: ."
+    )
+    data = SLIGHTLY_CORRUPT_LOG_DATA + "\nnoise\n" + bad_line + "\n"
+    expected = f"Failed to parse log line {data.count(chr(10))}: {bad_line!r}"
+    log_path = tmp_path / "bad.log"
+    log_path.write_text(data)
+
+    mappings = []
+    original_map_plain_text_file = lupa._map_plain_text_file
+
+    def map_plain_text_file(f):
+        mappings.append(original_map_plain_text_file(f))
+        return mappings[-1]
+
+    monkeypatch.setattr(lupa, "_map_plain_text_file", map_plain_text_file)
+
+    # Whether the file is mapped and entries are skipped, streamed or parsed in
+    # parallel, the error points at the same line
+    with log_path.open() as f, pytest.raises(RuntimeError, match=re.escape(expected)):
+        parse_log_data_automagically(f)
+    # The mapping isn't left open until the generator is garbage collected
+    [mapped] = mappings
+    assert mapped.closed
+    with pytest.raises(RuntimeError, match=re.escape(expected)):
+        parse_log_data_automagically(io.StringIO(data))
+    monkeypatch.setattr(lupa, "PARALLEL_CHUNK_LINES", 2)
+    with pytest.raises(RuntimeError, match=re.escape(expected)):
+        parse_log_data_automagically(io.StringIO(data), ParseOptions(jobs=2))
+
+
+@pytest.mark.parametrize(
+    "compression,compress",
+    [
+        (Compression.GZIP, gzip.compress),
+        (Compression.BZIP2, bz2.compress),
+        (Compression.XZ, lzma.compress),
+    ],
+)
+def test_compressed_input(tmp_path, compression, compress):
+    log_path = tmp_path / "postgresql.log.compressed"
+    # Concatenated streams are read as one, like zcat does
+    data = SLIGHTLY_CORRUPT_LOG_DATA.encode()
+    log_path.write_bytes(compress(data[:1000]) + compress(data[1000:]))
+
+    with log_path.open() as f:
+        assert detect_compression(f) == compression
+        model = parse_log_data_automagically(f)
+    assert model == parse_log_data_automagically(io.StringIO(SLIGHTLY_CORRUPT_LOG_DATA))
+
+    with log_path.open() as f:
+        lines = list(parse_log_lines_automagically(f))
+    assert lines == list(
+        parse_log_lines_automagically(io.StringIO(SLIGHTLY_CORRUPT_LOG_DATA))
+    )
+
+    log_path.write_bytes(compress(data)[:-20])
+    with log_path.open() as f, pytest.raises(EOFError):
+        parse_log_data_automagically(f)
+
+    with log_path.open() as f:
+        f.buffer.read()
+        assert detect_compression(f) is None
+    assert detect_compression(io.StringIO(TINY_LOG_DATA)) is None
+
+
+def test_sniff_carrier_format():
+    assert sniff_carrier_format(TINY_LOG_DATA) == CarrierFormat.PLAIN
+    assert sniff_carrier_format("[2929634] LOG:  hello") == CarrierFormat.PLAIN
+    assert (
+        sniff_carrier_format('\n[\n  {"textPayload": "x"') == CarrierFormat.GOOGLE_JSON
+    )
+    assert sniff_carrier_format("[]") == CarrierFormat.GOOGLE_JSON
+    assert (
+        sniff_carrier_format('{"textPayload": "x", "timestamp": "y"}\n{"textPa')
+        == CarrierFormat.JSON_LINES
+    )
+
+
+def test_json_lines_input():
+    records = [
+        {
+            "textPayload": line,
+            "timestamp": "2022-05-22T08:50:29.123456Z",
+        }
+        for line in TINY_LOG_DATA.strip().splitlines()
+    ]
+    data = "\n".join(json.dumps(record) for record in records)
+    lines = list(parse_log_lines_automagically(io.StringIO(data)))
+    assert len(lines) == 10
+    assert lines[0].timestamp == datetime.datetime(
+        2022, 5, 22, 8, 50, 29, 123456, tzinfo=datetime.timezone.utc
+    )
+
+
+def test_iter_json_array_small_chunks():
+    data = json.dumps(
+        [{"textPayload": "x]" * 50, "n": i, "f": i / 4} for i in range(20)] + [-1e3]
+    )
+    for chunk_size in (1, 3, 64):
+        records = iter_json_array(data[:5], io.StringIO(data[5:]), chunk_size)
+        assert list(records) == json.loads(data)
+
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array("", io.StringIO("[1, 2"), 2))
+
+
+def test_dispatch_matcher():
+    match = make_dispatch_matcher(
+        ["LOG:  duration: ", "LOG:  disconnection: ", "ERROR:  deadlock detected"]
+    )
+    assert match("2022-05-22 10:50:29 CEST [1] LOG:  duration: 1.000 ms") == (
+        "2022-05-22 10:50:29 CEST [1] ",
+        "LOG:  duration: ",
+        "1.000 ms",
+    )
+    assert match("[1] ERROR:  deadlock detected") == (
+        "[1] ",
+        "ERROR:  deadlock detected",
+        "",
+    )
+    assert match("[1] LOG:  connection received: host=1.2.3.4") is None
+    assert match("[1] ERROR:  duration: 1.000 ms") is None
+
+    with pytest.raises(ValueError):
+        make_dispatch_matcher(["duration: "])
+
+
 def test_constructed_matchers_make_default():
     matcher = make_prefix_parser("%m [%p] ")
     assert matcher("2022-05-22 10:50:29.123 CEST [2929634] ")